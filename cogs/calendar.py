@@ -1,13 +1,12 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import aiohttp
 import datetime
 import pytz
 from typing import Dict, List, Optional
 
-ALADHAN_G_TO_H_URL = 'http://api.aladhan.com/v1/gToH'
-ALADHAN_H_TO_G_CALENDAR_URL = 'http://api.aladhan.com/v1/hToGCalendar'
+import hijri
+
 EMBED_COLOR = 0x757e8a
 
 HIJRI_MONTHS = [
@@ -63,7 +62,7 @@ SPECIAL_DAY_INFO = [
      "Voluntary fasting and increased good deeds are encouraged during the sacred months."),
 ]
 
-# Universal dates AlAdhan's feed doesn't mark, keyed by (hijri month, day)
+# Universal dates the holiday feed (see hijri.HOLIDAYS) doesn't mark, keyed by (hijri month, day)
 LOCAL_SPECIAL_DAYS = {
     (1, 1): ("Islamic New Year",
              "The Hijri year begins with Muharram, one of the four sacred months.",
@@ -202,7 +201,7 @@ def build_calendar_embed(days: List[Dict], today: datetime.date) -> discord.Embe
             value = value[:1010].rsplit('\n', 1)[0] + '\n…'
         embed.add_field(name="Important Dates", value=value, inline=False)
 
-    embed.set_footer(text=f"Today: {today.strftime('%A, %d %B %Y')} | Data: AlAdhan")
+    embed.set_footer(text=f"Today: {today.strftime('%A, %d %B %Y')} | Umm al-Qura calendar")
     return embed
 
 
@@ -282,11 +281,7 @@ class CalendarView(discord.ui.View):
         return True
 
     async def show_month(self, interaction: discord.Interaction, month: int, year: int):
-        try:
-            days = await self.cog.fetch_hijri_month(month, year)
-        except Exception as e:
-            await interaction.response.send_message(f"Couldn't load that month: {e}", ephemeral=True)
-            return
+        days = self.cog.hijri_month(month, year)
         view = CalendarView(self.cog, self.user_id, month, year, self.timezone_name, days)
         view.message = self.message
         await interaction.response.edit_message(embed=build_calendar_embed(days, local_today(self.timezone_name)), view=view)
@@ -316,51 +311,33 @@ class CalendarView(discord.ui.View):
 class CalendarCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session: Optional[aiohttp.ClientSession] = None
-
-    async def cog_load(self):
-        self.session = aiohttp.ClientSession()
-
-    async def cog_unload(self):
-        if self.session:
-            await self.session.close()
 
     @commands.Cog.listener()
     async def on_ready(self):
         print(f"{__name__} is online")
 
-    async def fetch_json(self, url: str):
-        async with self.session.get(url) as resp:
-            data = await resp.json()
-            if resp.status != 200 or data.get('code') != 200:
-                raise Exception(f"AlAdhan returned status {data.get('code', resp.status)}")
-            return data['data']
+    def current_hijri_month(self, today: datetime.date):
+        year, month, _ = hijri.to_hijri(today)
+        return month, year
 
-    async def current_hijri_month(self, today: datetime.date):
-        data = await self.fetch_json(f"{ALADHAN_G_TO_H_URL}/{today.strftime('%d-%m-%Y')}")
-        return data['hijri']['month']['number'], int(data['hijri']['year'])
-
-    async def fetch_hijri_month(self, month: int, year: int) -> List[Dict]:
-        return await self.fetch_json(f"{ALADHAN_H_TO_G_CALENDAR_URL}/{month}/{year}")
+    def hijri_month(self, month: int, year: int) -> List[Dict]:
+        """A month's days in Aladhan's hToGCalendar shape, converted locally."""
+        return hijri.month_days(month, year)
 
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='calendar', description='Browse the Islamic (Hijri) calendar with important dates.')
     async def calendar(self, interaction: discord.Interaction):
-        await interaction.response.defer()
-
         settings = await self.bot.db.get_user(interaction.user.id)
         timezone_name = settings['timezone'] if settings else 'UTC'
         today = local_today(timezone_name)
 
-        try:
-            month, year = await self.current_hijri_month(today)
-            days = await self.fetch_hijri_month(month, year)
-        except Exception as e:
-            await interaction.edit_original_response(content=f"Couldn't load the calendar: {e}. Try again later.")
-            return
+        # Converted locally, so the calendar answers without deferring
+        month, year = self.current_hijri_month(today)
+        days = self.hijri_month(month, year)
         view = CalendarView(self, str(interaction.user.id), month, year, timezone_name, days)
-        view.message = await interaction.edit_original_response(embed=build_calendar_embed(days, today), view=view)
+        await interaction.response.send_message(embed=build_calendar_embed(days, today), view=view)
+        view.message = await interaction.original_response()
 
 
 async def setup(bot):
@@ -19,7 +19,6 @@ OVERPASS_ENDPOINTS = [
     'https://overpass.openstreetmap.fr/api/interpreter',
     'https://overpass.kumi.systems/api/interpreter',
 ]
-USER_AGENT = 'Adhan-Bot/1.0'
 PAGE_SIZE = 10
 OVERPASS_TIMEOUT = 30
 
@@ -133,18 +132,10 @@ class PaginationView(discord.ui.View):
 class MosqueCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session: Optional[aiohttp.ClientSession] = None
         # (lat, lon, radius) -> (expires_at, (mosques, effective_radius))
         self.search_cache: Dict[Tuple, Tuple] = {}
         self.preferred_endpoint = OVERPASS_ENDPOINTS[0]
 
-    async def cog_load(self):
-        self.session = aiohttp.ClientSession(headers={'User-Agent': USER_AGENT})
-
-    async def cog_unload(self):
-        if self.session:
-            await self.session.close()
-
     @commands.Cog.listener()
     async def on_ready(self):
         print(f"{__name__} is online")
@@ -264,13 +255,12 @@ class MosqueCog(commands.Cog):
         non-whitelisted clients), so no status is treated as fatal.
         """
         last_exc = None
-        timeout = aiohttp.ClientTimeout(total=OVERPASS_TIMEOUT + 5)
 
         endpoints = [self.preferred_endpoint] + [e for e in OVERPASS_ENDPOINTS if e != self.preferred_endpoint]
 
         for endpoint in endpoints:
             try:
-                async with self.session.post(endpoint, data=overpass_query, timeout=timeout) as resp:
+                async with self.bot.http_client.post('overpass', endpoint, data=overpass_query) as resp:
                     if resp.status == 200:
                         self.preferred_endpoint = endpoint
                         return await resp.json()
@@ -322,7 +312,7 @@ class MosqueCog(commands.Cog):
 
     async def get_coordinates(self, query: str):
         params = {'q': query, 'format': 'json', 'limit': 1}
-        async with self.session.get(GEOCODING_API_URL, params=params) as resp:
+        async with self.bot.http_client.get('nominatim', GEOCODING_API_URL, params=params) as resp:
             if resp.status != 200:
                 return None
             data = await resp.json()
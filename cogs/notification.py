@@ -1,136 +1,227 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-import aiohttp
 import pytz
 import datetime
 import asyncio
+import time
+
+from cogs.timing import next_prayer_datetime
+from database import SCHEDULE_COLUMNS
+from dispatch import DispatchQueue
+from scheduler import NotificationScheduler
 
-ALADHAN_API_URL = 'http://api.aladhan.com/v1/timings'
 EMBED_COLOR = 0x757e8a
 
+REFILL_SECONDS = 30
+LOOKAHEAD_SECONDS = 60
+SCHEDULE_EXTEND_HOURS = 6
+RESTORE_PAGE_SIZE = 1000
+# Settings a queued reminder was built from (the DM text names the city)
+REMINDER_COLUMNS = frozenset(SCHEDULE_COLUMNS | {'city'})
+
+
+class LazyDM:
+    """Sends straight to a user's DM channel by ID.
+
+    The channel ID is persisted in user_settings the first time it's known,
+    so after a restart a reminder is a single REST call: no fetch_user and
+    no create_dm. Users without a stored ID get their DM channel opened on
+    the first send, and a stored ID Discord no longer knows is dropped and
+    reopened once. `pace`, if given, is awaited before each of those extra
+    REST calls (the dispatcher's acquire(); it already paced the first post).
+    """
+
+    def __init__(self, bot, user_id, channel_id=None, pace=None):
+        self.bot = bot
+        self.pace = pace
+        self.id = int(user_id)
+        self.name = str(user_id)
+        self.channel = None
+        if channel_id:
+            self.channel = bot.get_partial_messageable(channel_id, type=discord.ChannelType.private)
+
+    async def open_channel(self):
+        if self.pace is not None:
+            await self.pace()
+        self.channel = await self.bot.create_dm(discord.Object(self.id))
+        await self.bot.db.update_user(self.id, dm_channel_id=self.channel.id)
+
+    async def send(self, *args, **kwargs):
+        if self.channel is None:
+            await self.open_channel()
+            return await self.channel.send(*args, **kwargs)
+        try:
+            return await self.channel.send(*args, **kwargs)
+        except discord.NotFound:
+            await self.open_channel()
+            if self.pace is not None:
+                await self.pace()
+            return await self.channel.send(*args, **kwargs)
 
-def timings_url_and_params(settings, date_str):
-    """Aladhan coordinate-endpoint URL and query params (aiohttp needs strings)."""
-    return f"{ALADHAN_API_URL}/{date_str}", {
-        'latitude': str(settings["latitude"]),
-        'longitude': str(settings["longitude"]),
-        'method': settings["calculation_method"],
-        'school': settings["asr_method"],
-        'timezonestring': settings["timezone"],
-        'tune': '0,0,0,0,0,0,0,0,0',
-    }
 
 class NotificationsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.notification_tasks = {}
-        self.loop_notifications = {}
+        # user_id -> discord.User (or LazyDM) for everyone with an active /notifyloop.
+        # Their prayers come from prayer_schedule: each refill moves the ones
+        # due within LOOKAHEAD_SECONDS into the shared in-memory scheduler.
+        self.loop_users = {}
+        self.loop_errors = {}
+        self.scheduler = NotificationScheduler(self.send_due_notifications)
+        self.dispatcher = DispatchQueue()
+        self.loaded_until = time.time()
+        self.restore_progress = {'restored': 0, 'done': False}
+        self._background = set()
+        self.bot.db.changes.subscribe(self.on_settings_change)
         self.bot.loop.create_task(self.restore_notification_loops())
 
+    async def cog_load(self):
+        self.dispatcher.start()
+        self.scheduler.start()
+        self.refill_schedule.start()
+        self.extend_schedule.start()
+
     def cog_unload(self):
+        self.bot.db.changes.unsubscribe(self.on_settings_change)
         for task in self.notification_tasks.values():
             task.cancel()
-        for task in list(self.loop_notifications.values()):
+        for task in list(self._background):
             task.cancel()
-
-
-    async def notification_loop(self, user, user_timezone):
-        """Continuously notify user of upcoming prayers.
-
-        Errors are retried inside the loop so one failed API call or DM
-        can't silently end the subscription.
-        """
-        user_id = str(user.id)
-        consecutive_errors = 0
-
+        self.refill_schedule.cancel()
+        self.extend_schedule.cancel()
+        self.scheduler.stop()
+        self.dispatcher.stop()
+
+    def stats(self):
+        """Scheduler and DM pipeline counters, for capacity planning."""
+        return {
+            'loops': len(self.loop_users),
+            'restore': dict(self.restore_progress),
+            'scheduler': self.scheduler.stats(),
+            'dispatch': self.dispatcher.stats(),
+        }
+
+    def user_handle(self, user_id, channel_id=None):
+        """Something to DM the user through, without a REST round trip."""
+        return LazyDM(self.bot, user_id, channel_id, pace=self.dispatcher.acquire)
+
+    def run_in_background(self, coro):
+        task = self.bot.loop.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    @tasks.loop(seconds=REFILL_SECONDS)
+    async def refill_schedule(self):
+        """Queue every active loop's prayers due before the next refill."""
+        until = time.time() + LOOKAHEAD_SECONDS
         try:
-            while user_id in self.loop_notifications:
-                try:
-                    settings = await self.bot.db.get_user(user_id)
-                    if not settings or settings["latitude"] is None:
-                        break
-
-                    user_timezone = pytz.timezone(settings["timezone"])
-                    url, params = timings_url_and_params(settings, datetime.datetime.now(user_timezone).strftime('%d-%m-%Y'))
-
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, params=params) as response:
-                            data = await response.json()
-                            timings = data.get('data', {}).get('timings', {})
-
-                    current_time = datetime.datetime.now(user_timezone)
-                    prayer_times = {}
-
-                    for prayer in ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]:
-                        if prayer in timings:
-                            prayer_time = datetime.datetime.strptime(timings[prayer], '%H:%M').time()
-                            prayer_datetime = datetime.datetime.combine(current_time.date(), prayer_time)
-
-                            prayer_datetime = user_timezone.localize(prayer_datetime)
-
-                            if prayer_datetime <= current_time:
-                                prayer_datetime += datetime.timedelta(days=1)
-
-                            prayer_times[prayer] = prayer_datetime
-
-                    if not prayer_times:
-                        await asyncio.sleep(300)
-                        continue
-
-                    next_prayer_name, next_prayer_time = min(prayer_times.items(), key=lambda x: x[1])
-
-                    current_time = datetime.datetime.now(user_timezone)
-                    delay_seconds = max(0, (next_prayer_time - current_time).total_seconds())
-
-                    await asyncio.sleep(delay_seconds)
-
-
-                    current_time = datetime.datetime.now(user_timezone)
-                    time_diff = (next_prayer_time - current_time).total_seconds()
-
-                    if time_diff > 30:
-                        print(f"Woke up {time_diff} seconds early, waiting additional time")
-                        await asyncio.sleep(time_diff)
-
-                    if user_id in self.loop_notifications:
-                        prayer_time_12hr = next_prayer_time.strftime('%I:%M %p')
-                        try:
-                            await user.send(f"It's time for {next_prayer_name} in {settings['city']}! at {prayer_time_12hr}")
-                        except discord.Forbidden:
-
-                            await self.bot.db.update_user(user_id, notify_loop_active=False)
-                            break
+            due = await self.bot.db.get_due_prayers(self.loaded_until, until)
+        except Exception as e:
+            # An exception would end the task loop for good; loaded_until stays
+            # put so the next refill covers this window too
+            print(f"Error refilling notification schedule: {e}")
+            return
+        for user_id, prayer, fire_at, city, timezone, channel_id in due:
+            self.scheduler.schedule(user_id, fire_at, (prayer, fire_at, city, timezone, channel_id))
+        self.loaded_until = until
 
-                        await asyncio.sleep(1)
+    @refill_schedule.before_loop
+    async def before_refill_schedule(self):
+        await self.bot.wait_until_ready()
 
-                        print(f"Sent {next_prayer_name} notification to {user.name} at {datetime.datetime.now(user_timezone).strftime('%H:%M:%S')}")
+    @tasks.loop(hours=SCHEDULE_EXTEND_HOURS)
+    async def extend_schedule(self):
+        try:
+            added = await self.bot.db.extend_schedule()
+            print(f"Extended prayer schedule by {added} entries")
+        except Exception as e:
+            print(f"Error extending prayer schedule: {e}")
+
+    def on_settings_change(self, kind, user_id, settings, fields):
+        """Database change subscriber: keeps queued reminders in step with
+        the settings they were built from, as soon as those are committed."""
+        if kind == 'deleted':
+            self.stop_loop_for(user_id)
+            self.cancel_notify(user_id)
+            return
+        if kind == 'rescheduled':
+            # Same settings, but the queued entry may be from the old rows
+            if user_id in self.loop_users:
+                self.scheduler.cancel(user_id)
+                self.run_in_background(self.load_user(user_id, settings))
+            return
+        if 'notify_loop_active' in fields and not settings.notify_loop_active:
+            self.stop_loop_for(user_id)
+        elif user_id in self.loop_users and fields & REMINDER_COLUMNS:
+            # The queued entry has the old time and city; the schedule rows
+            # were regenerated in the same commit (offline, until the
+            # timings source's arrive as 'rescheduled')
+            self.scheduler.cancel(user_id)
+            self.run_in_background(self.load_user(user_id, settings))
+        if fields & REMINDER_COLUMNS:
+            task = self.notification_tasks.get(user_id)
+            if task and not task.done():
+                self.run_in_background(self.replan_notify(user_id, settings))
+
+    async def load_user(self, user_id, settings=None):
+        """Queue a new subscriber's next salah if the last refill already
+        passed over it."""
+        try:
+            scheduled = await self.bot.db.next_scheduled_prayer(user_id)
+            if settings is None:
+                settings = await self.bot.db.get_user(user_id)
+        except Exception as e:
+            print(f"Error loading schedule for user {user_id}: {e}")
+            return
+        if not scheduled or not settings or user_id not in self.loop_users:
+            return
+        prayer, fire_at = scheduled
+        if fire_at <= self.loaded_until:
+            self.scheduler.schedule(user_id, fire_at, (prayer, fire_at, settings['city'], settings['timezone'], settings['dm_channel_id']))
+
+    async def loop_error(self, user_id, user, error):
+        consecutive_errors = self.loop_errors.get(user_id, 0) + 1
+        self.loop_errors[user_id] = consecutive_errors
+        print(f"Error in notification loop for user {user_id} (#{consecutive_errors}): {error}")
+        if consecutive_errors == 1:
+            try:
+                await self.dispatcher.send(user, "There was an error with your prayer notification loop — retrying automatically. If notifications stop, run /notifyloop again.")
+            except Exception:
+                pass
 
-                    consecutive_errors = 0
+    async def send_due_notifications(self, batch):
+        """Scheduler callback: everyone whose salah fell in the same second."""
+        await asyncio.gather(*(self.deliver(user_id, payload) for user_id, payload in batch))
 
-                except asyncio.CancelledError:
-                    raise
-                except Exception as e:
-                    consecutive_errors += 1
-                    print(f"Error in notification loop for user {user_id} (#{consecutive_errors}): {e}")
-                    if consecutive_errors == 1:
-                        try:
-                            await user.send("There was an error with your prayer notification loop — retrying automatically. If notifications stop, run /notifyloop again.")
-                        except Exception:
-                            pass
-                    await asyncio.sleep(600)
+    async def deliver(self, user_id, payload):
+        next_prayer_name, fire_at, city, timezone, channel_id = payload
+        user = self.loop_users.get(user_id)
+        if user is None:
+            # Due before restore got to them
+            user = self.loop_users[user_id] = self.user_handle(user_id, channel_id)
 
-        except asyncio.CancelledError:
-            pass
-        finally:
-            if self.loop_notifications.get(user_id) is asyncio.current_task():
-                del self.loop_notifications[user_id]
+        next_prayer_time = datetime.datetime.fromtimestamp(fire_at, pytz.timezone(timezone))
+        prayer_time_12hr = next_prayer_time.strftime('%I:%M %p')
+        try:
+            await self.dispatcher.send(user, f"It's time for {next_prayer_name} in {city}! at {prayer_time_12hr}", due_at=fire_at)
+        except discord.Forbidden:
+            self.stop_loop_for(user_id)
+            await self.bot.db.update_user(user_id, notify_loop_active=False, dm_channel_id=None)
+            return
+        except Exception as e:
+            await self.loop_error(user_id, user, e)
+            return
+        self.loop_errors.pop(user_id, None)
+        print(f"Sent {next_prayer_name} notification to {user.name} at {datetime.datetime.now(next_prayer_time.tzinfo).strftime('%H:%M:%S')}")
 
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='notify', description='Reminds you when it is time for Fajr, Dhuhr, Asr, Maghrib and Isha.')
     async def notify(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
+        user_id = interaction.user.id
 
         await interaction.response.defer(ephemeral=True)
 
@@ -139,111 +230,116 @@ class NotificationsCog(commands.Cog):
             if settings["latitude"] is None:
                 await interaction.followup.send("Your saved location needs a refresh, please run /setup again.", ephemeral=True)
                 return
-            url, params = timings_url_and_params(settings, datetime.datetime.now().strftime('%d-%m-%Y'))
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    data = await response.json()
-                    timings = data.get('data', {}).get('timings', {})
-
-                    user_timezone = pytz.timezone(settings["timezone"])
-                    current_time = datetime.datetime.now(user_timezone)
-
-                    prayer_times = {}
-
-                    for prayer in ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]:
-                        if prayer in timings:
-                            prayer_time = datetime.datetime.strptime(timings[prayer], '%H:%M').time()
-                            prayer_datetime = datetime.datetime.combine(current_time.date(), prayer_time)
-
-                            prayer_datetime = user_timezone.localize(prayer_datetime)
-
-                            if prayer_datetime <= current_time:
-                                prayer_datetime += datetime.timedelta(days=1)
-
-                            prayer_times[prayer] = prayer_datetime
+            next_prayer_name, next_prayer_time = await self.next_prayer_for(settings)
 
-                    if not prayer_times:
-                        embed = discord.Embed(title="Notification", description=f"Notification is only available for Fajr, Dhuhr, Asr, Maghrib and Isha. Please check your settings or try again later.", color=EMBED_COLOR)
-                        await interaction.followup.send(embed=embed)
-                        return
-
-                    next_prayer = min(prayer_times.items(), key=lambda x: x[1])
-                    next_prayer_name, next_prayer_time = next_prayer
+            if not next_prayer_name:
+                embed = discord.Embed(title="Notification", description=f"Notification is only available for Fajr, Dhuhr, Asr, Maghrib and Isha. Please check your settings or try again later.", color=EMBED_COLOR)
+                await interaction.followup.send(embed=embed)
+                return
 
-                    next_time_12hr = next_prayer_time.strftime('%I:%M %p')
+            next_time_12hr = next_prayer_time.strftime('%I:%M %p')
 
-                    embed = discord.Embed(title="Notification Scheduled", description=f"Next upcoming salah for {settings['city']} is {next_prayer_name} at {next_time_12hr}. You will be pinged again in DM when it's time.", color=EMBED_COLOR)
-                    try:
-                        await interaction.user.send(embed=embed)
-                    except discord.Forbidden:
-                        await interaction.followup.send("I can't DM you — enable direct messages from server members, then run /notify again.", ephemeral=True)
-                        return
+            embed = discord.Embed(title="Notification Scheduled", description=f"Next upcoming salah for {settings['city']} is {next_prayer_name} at {next_time_12hr}. You will be pinged again in DM when it's time.", color=EMBED_COLOR)
+            try:
+                await interaction.user.send(embed=embed)
+            except discord.Forbidden:
+                await interaction.followup.send("I can't DM you — enable direct messages from server members, then run /notify again.", ephemeral=True)
+                return
 
-                    try:
-                        await interaction.followup.send("You will be notified when it is the time for salah in your direct messages.", ephemeral=True)
-                    except discord.HTTPException as e:
-                        if e.status == 429:
-                            retry_after = int(e.response.headers.get('Retry-After', 1))
-                            await asyncio.sleep(retry_after)
-                            await interaction.followup.send("You will be notified when it is the time for salah in your direct messages.", ephemeral=True)
+            try:
+                await interaction.followup.send("You will be notified when it is the time for salah in your direct messages.", ephemeral=True)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    retry_after = int(e.response.headers.get('Retry-After', 1))
+                    await asyncio.sleep(retry_after)
+                    await interaction.followup.send("You will be notified when it is the time for salah in your direct messages.", ephemeral=True)
 
 
-                    existing = self.notification_tasks.get(user_id)
-                    if existing and not existing.done():
-                        existing.cancel()
-                    task = self.bot.loop.create_task(self.schedule_notification_datetime(interaction.user, next_prayer_time, next_prayer_name, user_timezone))
-                    self.notification_tasks[user_id] = task
+            self.schedule_notify(interaction.user, next_prayer_time, next_prayer_name, settings['city'])
         else:
             await interaction.followup.send("Please set up your region using /setup first.", ephemeral=True)
 
-    async def schedule_notification_datetime(self, user, notify_datetime, next_prayer, user_timezone):
-        """Schedule notification using a datetime object instead of a time string"""
+    async def next_prayer_for(self, settings):
+        """Name and aware datetime of the user's next salah today, or (None, None)."""
         try:
-            current_time = datetime.datetime.now(user_timezone)
+            timings = await self.bot.timings.today(settings)
+        except Exception:
+            timings = {}
+        return next_prayer_datetime(timings, pytz.timezone(settings["timezone"]))
+
+    def schedule_notify(self, user, notify_datetime, next_prayer, city):
+        """Arm the one-off /notify reminder, replacing any pending one."""
+        self.cancel_notify(user.id)
+        task = self.bot.loop.create_task(self.schedule_notification_datetime(user, notify_datetime, next_prayer, city))
+        self.notification_tasks[user.id] = task
+
+    def cancel_notify(self, user_id):
+        task = self.notification_tasks.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
 
-            delay_seconds = (notify_datetime - current_time).total_seconds()
+    async def replan_notify(self, user_id, settings):
+        """Move a pending /notify reminder to the next salah under new settings."""
+        next_prayer_name, next_prayer_time = await self.next_prayer_for(settings)
+        if next_prayer_name:
+            self.schedule_notify(self.user_handle(user_id, settings['dm_channel_id']), next_prayer_time, next_prayer_name, settings['city'])
+        else:
+            self.cancel_notify(user_id)
 
-            delay_seconds = max(0, delay_seconds)
+    async def schedule_notification_datetime(self, user, notify_datetime, next_prayer, city):
+        """Sleep until notify_datetime, then DM the reminder. Cancelled and
+        re-armed by on_settings_change if the user's settings move it."""
+        try:
+            delay_seconds = max(0, notify_datetime.timestamp() - time.time())
 
             await asyncio.sleep(delay_seconds)
 
-
-            settings = await self.bot.db.get_user(user.id)
             prayer_time_12hr = notify_datetime.strftime('%I:%M %p')
-            await user.send(f"It's time for {next_prayer} in {settings['city']}! at {prayer_time_12hr}")
+            await self.dispatcher.send(user, f"It's time for {next_prayer} in {city}! at {prayer_time_12hr}", due_at=notify_datetime.timestamp())
 
         except asyncio.CancelledError:
             pass
         except Exception as e:
             print(f"Error in schedule_notification_datetime for user {user.id}: {e}")
             try:
-                await user.send("There was an error with your prayer notification. Please try using /notify again.")
+                await self.dispatcher.send(user, "There was an error with your prayer notification. Please try using /notify again.")
             except:
                 pass
 
 
     def start_loop_for(self, user, settings):
-        """Start the per-salah DM loop for a user unless one is already running.
+        """Subscribe a user to per-salah DMs unless they already are.
 
-        Shared by /notifyloop and the opt-in prompt at the end of /setup.
+        Shared by /notifyloop, the opt-in prompt at the end of /setup and the
+        settings panel.
         """
-        user_id = str(user.id)
-        existing = self.loop_notifications.get(user_id)
-        if existing and not existing.done():
+        user_id = user.id
+        if user_id in self.loop_users:
             return
-        user_timezone = pytz.timezone(settings["timezone"])
-        self.loop_notifications[user_id] = self.bot.loop.create_task(self.notification_loop(user, user_timezone))
+        channel_id = settings["dm_channel_id"]
+        channel = getattr(user, 'dm_channel', None)
+        if channel is not None and channel.id != channel_id:
+            channel_id = channel.id
+            self.run_in_background(self.bot.db.update_user(user_id, dm_channel_id=channel_id))
+        self.loop_users[user_id] = self.user_handle(user_id, channel_id)
+        self.run_in_background(self.load_user(user_id))
+
+    def stop_loop_for(self, user_id) -> bool:
+        """Unsubscribe a user; returns False if they had no active loop."""
+        user_id = int(user_id)
+        self.scheduler.cancel(user_id)
+        self.loop_errors.pop(user_id, None)
+        return self.loop_users.pop(user_id, None) is not None
 
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='notifyloop', description='Set a notification chain for all upcoming salahs.')
     async def notifyloop(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
+        user_id = interaction.user.id
 
         await interaction.response.defer(ephemeral=True)
 
-        if user_id in self.loop_notifications and not self.loop_notifications[user_id].done():
+        if user_id in self.loop_users:
             await interaction.followup.send("You already have an active prayer notification loop. Use `/notifyloopstop` to stop it first.", ephemeral=True)
             return
 
@@ -275,11 +371,9 @@ class NotificationsCog(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='notifyloopstop', description='Stop the notification chain for upcoming salahs.')
     async def notifyloopstop(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
-
-        if user_id in self.loop_notifications and not self.loop_notifications[user_id].done():
-            self.loop_notifications[user_id].cancel()
+        user_id = interaction.user.id
 
+        if self.stop_loop_for(user_id):
             await self.bot.db.update_user(user_id, notify_loop_active=False)
 
             await interaction.response.send_message("Prayer notification loop has been stopped.", ephemeral=True)
@@ -287,18 +381,23 @@ class NotificationsCog(commands.Cog):
             await interaction.response.send_message("You don't have an active prayer notification loop.", ephemeral=True)
 
     async def restore_notification_loops(self):
-        """Restore notification loops for users who had them active before restart"""
-        await self.bot.wait_until_ready()
-
-        for settings in await self.bot.db.get_notify_loop_users():
-            user_id = settings["user_id"]
-            try:
-                user = await self.bot.fetch_user(int(user_id))
-                if user and settings.get("timezone"):
-                    self.start_loop_for(user, settings)
-            except Exception as e:
-                print(f"Error restoring notification loop for user {user_id}: {e}")
+        """Restore notification loops for users who had them active before restart.
 
+        Pages through the table and only builds lazy handles, so there is no
+        REST call per subscriber and restart time barely grows with users.
+        Prayers falling due meanwhile still go out: the refill reads active
+        loops straight from the database, not from this restore.
+        """
+        try:
+            async for settings in self.bot.db.iter_users(RESTORE_PAGE_SIZE, notify_loop_active=True):
+                user_id = settings["user_id"]
+                if settings["timezone"] and user_id not in self.loop_users:
+                    self.loop_users[user_id] = self.user_handle(user_id, settings["dm_channel_id"])
+                self.restore_progress['restored'] += 1
+        except Exception as e:
+            print(f"Error restoring notification loops: {e}")
+        self.restore_progress['done'] = True
+        print(f"Restored {self.restore_progress['restored']} notification loops")
 
 async def setup(bot):
     await bot.add_cog(NotificationsCog(bot))
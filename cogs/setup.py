@@ -1,37 +1,38 @@
-import asyncio
 import discord
 from discord.ext import commands
 from discord import app_commands
 from timezonefinder import TimezoneFinder
-from geopy.geocoders import Nominatim
 
 DEFAULT_ASR_METHOD = '1'
 DEFAULT_CALC_METHOD = '2'
 
-geolocator = Nominatim(user_agent="discord_prayer_bot")
+GEOCODING_API_URL = 'https://nominatim.openstreetmap.org/search'
+
 tf = TimezoneFinder()
 
 
-async def geocode_location(city: str, country: str):
+async def geocode_location(http, city: str, country: str):
     """Resolve free-text city/country to canonical names, timezone and coordinates.
 
     Returns None when the location can't be found - callers must not save
-    anything in that case. Runs in a thread because geopy is blocking.
+    anything in that case.
     """
-    location = await asyncio.to_thread(
-        geolocator.geocode, f"{city}, {country}",
-        addressdetails=True, language='en',
-    )
-    if not location:
+    params = {'q': f"{city}, {country}", 'format': 'json', 'limit': 1, 'addressdetails': 1, 'accept-language': 'en'}
+    async with http.get('nominatim', GEOCODING_API_URL, params=params) as resp:
+        if resp.status != 200:
+            return None
+        data = await resp.json()
+    if not data:
         return None
-    address = location.raw.get('address', {})
+    latitude, longitude = float(data[0]['lat']), float(data[0]['lon'])
+    address = data[0].get('address', {})
     return {
         'city': address.get('city') or address.get('town') or address.get('village')
                 or address.get('municipality') or address.get('county') or city,
         'country': address.get('country') or country,
-        'timezone': tf.timezone_at(lng=location.longitude, lat=location.latitude) or "UTC",
-        'latitude': location.latitude,
-        'longitude': location.longitude,
+        'timezone': tf.timezone_at(lng=longitude, lat=latitude) or "UTC",
+        'latitude': latitude,
+        'longitude': longitude,
     }
 
 calculation_methods = {
@@ -67,12 +68,11 @@ class AsrMethodSelect(discord.ui.Select):
         )
 
     async def callback(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
-        await self.view.bot.db.update_user(user_id, asr_method=self.values[0])
+        self.view.choices['asr_method'] = self.values[0]
 
         await interaction.response.edit_message(
             content="Asr timing method set. Now, please select your calculation method:",
-            view=CalculationMethodView(self.view.bot)
+            view=CalculationMethodView(self.view.bot, self.view.choices)
         )
 
 
@@ -87,31 +87,35 @@ class CalculationMethodSelect(discord.ui.Select):
         )
 
     async def callback(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
-        await self.view.bot.db.update_user(user_id, calculation_method=self.values[0])
+        self.view.choices['calculation_method'] = self.values[0]
 
         await interaction.response.edit_message(
             content="Calculation method set. One last thing, do you want a DM at every salah time?",
-            view=NotifyPromptView(self.view.bot),
+            view=NotifyPromptView(self.view.bot, self.view.choices),
         )
 
 
 class NotifyPromptView(discord.ui.View):
-    """Final step of /setup: opt in to the per-salah notification loop."""
+    """Final step of /setup: opt in to the per-salah notification loop.
 
-    def __init__(self, bot):
+    Either answer saves the whole wizard in a single write.
+    """
+
+    def __init__(self, bot, choices: dict):
         super().__init__(timeout=180)
         self.bot = bot
+        self.choices = choices
+
+    async def save(self, interaction: discord.Interaction, notify: bool):
+        return await self.bot.db.upsert_user(interaction.user.id, notify_loop_active=notify, **self.choices)
 
     @discord.ui.button(label="Yes, notify me", style=discord.ButtonStyle.success)
     async def enable(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = str(interaction.user.id)
-        settings = await self.bot.db.get_user(user_id)
         notifications = self.bot.get_cog("NotificationsCog")
+        settings = await self.save(interaction, notify=notifications is not None)
 
-        if settings and notifications:
+        if notifications:
             notifications.start_loop_for(interaction.user, settings)
-            await self.bot.db.update_user(user_id, notify_loop_active=True)
             await interaction.response.edit_message(
                 content=f"Setup complete! You'll receive a DM at every salah time for {settings['city']}. Use /notifyloopstop anytime to turn this off.",
                 view=None,
@@ -124,11 +128,10 @@ class NotifyPromptView(discord.ui.View):
 
     @discord.ui.button(label="No thanks", style=discord.ButtonStyle.secondary)
     async def skip(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.save(interaction, notify=False)
         notifications = self.bot.get_cog("NotificationsCog")
         if notifications:
-            existing = notifications.loop_notifications.get(str(interaction.user.id))
-            if existing and not existing.done():
-                existing.cancel()
+            notifications.stop_loop_for(interaction.user.id)
         await interaction.response.edit_message(
             content="Setup complete! Your settings have been saved. You can enable per-salah DMs anytime with /notifyloop.",
             view=None,
@@ -136,16 +139,18 @@ class NotifyPromptView(discord.ui.View):
 
 
 class AsrMethodView(discord.ui.View):
-    def __init__(self, bot):
+    def __init__(self, bot, choices: dict):
         super().__init__()
         self.bot = bot
+        self.choices = choices
         self.add_item(AsrMethodSelect())
 
 
 class CalculationMethodView(discord.ui.View):
-    def __init__(self, bot):
+    def __init__(self, bot, choices: dict):
         super().__init__()
         self.bot = bot
+        self.choices = choices
         self.add_item(CalculationMethodSelect())
 
 
@@ -163,22 +168,24 @@ class ConfirmRegionView(discord.ui.View):
     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
         p = self.pending
         if self.in_setup:
-            await self.bot.db.upsert_user(
-                interaction.user.id,
-                country=p['country'],
-                city=p['city'],
-                timezone=p['timezone'],
-                latitude=p['latitude'],
-                longitude=p['longitude'],
-                asr_method=DEFAULT_ASR_METHOD,
-                calculation_method=DEFAULT_CALC_METHOD,
-            )
+            # Nothing is written until the wizard's last step
+            choices = {
+                'country': p['country'],
+                'city': p['city'],
+                'timezone': p['timezone'],
+                'latitude': p['latitude'],
+                'longitude': p['longitude'],
+                'asr_method': DEFAULT_ASR_METHOD,
+                'calculation_method': DEFAULT_CALC_METHOD,
+            }
             await interaction.response.edit_message(
-                content=f"Region saved as **{p['city']}, {p['country']}**. Now, please select your Asr timing method:",
-                view=AsrMethodView(self.bot),
+                content=f"Region set to **{p['city']}, {p['country']}**. Now, please select your Asr timing method:",
+                view=AsrMethodView(self.bot, choices),
             )
         else:
-            await self.bot.db.update_user(
+            # Running notification loops pick the new region up from the
+            # database's change events
+            settings = await self.bot.db.update_user(
                 interaction.user.id,
                 country=p['country'],
                 city=p['city'],
@@ -191,7 +198,6 @@ class ConfirmRegionView(discord.ui.View):
                 view=None,
             )
             if self.settings_view and self.settings_view.message:
-                settings = await self.bot.db.get_user(interaction.user.id)
                 view = SettingsView(self.bot, settings)
                 view.message = self.settings_view.message
                 try:
@@ -222,7 +228,7 @@ class SetupModal(discord.ui.Modal):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            result = await geocode_location(self.city.value, self.country.value)
+            result = await geocode_location(self.bot.http_client, self.city.value, self.country.value)
         except Exception as e:
             print(f"Error geocoding location: {e}")
             result = None
@@ -303,7 +309,7 @@ class RegionEditModal(discord.ui.Modal):
         await interaction.response.defer(ephemeral=True, thinking=True)
 
         try:
-            result = await geocode_location(self.city.value, self.country.value)
+            result = await geocode_location(self.bot.http_client, self.city.value, self.country.value)
         except Exception as e:
             print(f"Error geocoding location: {e}")
             result = None
@@ -332,7 +338,7 @@ class ConfirmDeleteView(discord.ui.View):
     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self.bot.db.delete_user(interaction.user.id)
         await interaction.response.edit_message(
-            content="Your data has been deleted. Notifications will stop shortly. Use /setup anytime to start again.",
+            content="Your data has been deleted and your notifications stopped. Use /setup anytime to start again.",
             embed=None,
             view=None,
         )
@@ -379,9 +385,7 @@ class SettingsView(discord.ui.View):
 
         if active:
             # Stop the loop
-            existing = notifications.loop_notifications.get(user_id)
-            if existing and not existing.done():
-                existing.cancel()
+            notifications.stop_loop_for(user_id)
             await self.bot.db.update_user(user_id, notify_loop_active=False)
             await interaction.response.send_message("Notifications paused.", ephemeral=True)
         else:
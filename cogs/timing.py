@@ -1,18 +1,28 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import aiohttp
 import pytz
+import asyncio
 import datetime
+import time
+from array import array
+from collections import OrderedDict
 from typing import Dict, List, Optional
 
-ALADHAN_API_URL = 'http://api.aladhan.com/v1/timings'
-ALADHAN_CALENDAR_URL = 'http://api.aladhan.com/v1/calendar'
+from stats import LatencyHistogram
+from timings_cache import cell_key
+
 EMBED_COLOR = 0x757e8a
 RESETUP_MESSAGE = "Your saved location needs a refresh, please run /setup again."
 PRAYERS = ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]
 
 ANSI_RESET = '\x1b[0m'
+TABLE_HEADER = "          Fajr  Dhuhr Asr   Magh  Isha"
+
+# Rendered month tables kept by TimingsCog, shared by everyone in a cell
+TABLE_CACHE_SIZE = 2048
+# Minute offset for a time the month doesn't have (polar days)
+NO_TIME = 0xFFFF
 
 
 def ansi(text: str, code: str) -> str:
@@ -20,17 +30,6 @@ def ansi(text: str, code: str) -> str:
     return f"\x1b[{code}m{text}{ANSI_RESET}"
 
 
-def timings_params(settings):
-    """Aladhan query params from stored coordinates (aiohttp needs strings)."""
-    return {
-        'latitude': str(settings["latitude"]),
-        'longitude': str(settings["longitude"]),
-        'method': settings["calculation_method"],
-        'school': settings["asr_method"],
-        'timezonestring': settings["timezone"],
-    }
-
-
 def clean_time(value: str) -> str:
     """Calendar-endpoint times carry a timezone suffix: '03:53 (+06)' -> '03:53'."""
     return value.split(' ')[0]
@@ -70,6 +69,63 @@ def week_start(date: datetime.date) -> datetime.date:
     return date - datetime.timedelta(days=(date.weekday() + 1) % 7)
 
 
+def minutes_of(value: str) -> int:
+    hours, minutes = clean_time(value).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class MonthTable:
+    """One month of timings parsed once: minutes after midnight per day and
+    prayer, plus the weekly/monthly table rows rendered without the "today"
+    highlight. Rendering then only patches today's row in."""
+
+    __slots__ = ('first', 'days', 'minutes', 'week_rows', 'month_rows', 'month_body')
+
+    def __init__(self, year: int, month: int, entries: List[Dict]):
+        self.first = datetime.date(year, month, 1)
+        self.days = len(entries)
+        minutes = array('H', [NO_TIME]) * (self.days * len(PRAYERS))
+        for entry in entries:
+            index = (int(entry['date']['gregorian']['day']) - 1) * len(PRAYERS)
+            timings = entry['timings']
+            for offset, prayer in enumerate(PRAYERS):
+                if prayer in timings:
+                    minutes[index + offset] = minutes_of(timings[prayer])
+        self.minutes = minutes
+        dates = [self.first + datetime.timedelta(days=day) for day in range(self.days)]
+        self.week_rows = [self.row(date, date.strftime('%a %d')) for date in dates]
+        self.month_rows = [self.row(date, date.strftime('%d %a')) for date in dates]
+        self.month_body = "\n".join(self.month_rows)
+
+    def times(self, day: int) -> str:
+        start = (day - 1) * len(PRAYERS)
+        return ' '.join(
+            '--:--' if value == NO_TIME else f"{value // 60:02d}:{value % 60:02d}"
+            for value in self.minutes[start:start + len(PRAYERS)]
+        )
+
+    def row(self, date: datetime.date, label: str, is_today: bool = False) -> str:
+        line = f"{'►' if is_today else ' '} {label}  {self.times(date.day)}"
+        if is_today:
+            return ansi(line, '1;37;45')       # white on magenta
+        if date.weekday() == 4:
+            return ansi(line, '0;32')          # green: Jumu'ah
+        return line
+
+    def week_row(self, date: datetime.date, today: datetime.date) -> str:
+        if date == today:
+            return self.row(date, date.strftime('%a %d'), is_today=True)
+        return self.week_rows[date.day - 1]
+
+    def body(self, today: datetime.date) -> str:
+        """The monthly table, with today's row highlighted if it's in it."""
+        if (today.year, today.month) != (self.first.year, self.first.month):
+            return self.month_body
+        rows = self.month_rows.copy()
+        rows[today.day - 1] = self.row(today, today.strftime('%d %a'), is_today=True)
+        return "\n".join(rows)
+
+
 class TimingsModeSelect(discord.ui.Select):
     def __init__(self, current: str):
         options = [
@@ -89,7 +145,15 @@ class TimingsModeSelect(discord.ui.Select):
 
 class TimingsView(discord.ui.View):
     """Browsable prayer timings: daily / weekly / monthly, with arrows whose
-    step size follows the active view. Month responses are cached per view."""
+    step size follows the active view. Months come from the bot's shared,
+    persistent timings store, so browsing doesn't refetch them.
+
+    After each render the months either side of the anchor are fetched in
+    the background, so an arrow press crossing a month renders from memory.
+    """
+
+    # Off only to measure without it (bench.py browse)
+    prefetch = True
 
     def __init__(self, cog, user_id: str, settings: Dict, anchor: datetime.date):
         super().__init__(timeout=300)
@@ -98,8 +162,8 @@ class TimingsView(discord.ui.View):
         self.settings = settings
         self.anchor = anchor
         self.mode = "daily"
-        self.month_cache: Dict[tuple, List[Dict]] = {}
         self.message: Optional[discord.Message] = None
+        self._prefetches = set()
         self.add_item(TimingsModeSelect(self.mode))
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
@@ -112,10 +176,33 @@ class TimingsView(discord.ui.View):
         return datetime.datetime.now(pytz.timezone(self.settings["timezone"])).date()
 
     async def month_data(self, year: int, month: int) -> List[Dict]:
-        key = (year, month)
-        if key not in self.month_cache:
-            self.month_cache[key] = await self.cog.fetch_month(self.settings, year, month)
-        return self.month_cache[key]
+        return await self.cog.fetch_month(self.settings, year, month)
+
+    async def load_months(self, *dates: datetime.date):
+        """Fetch the months the dates fall in concurrently, e.g. both halves
+        of a week straddling a month boundary."""
+        months = {(date.year, date.month) for date in dates}
+        await asyncio.gather(*(self.month_data(year, month) for year, month in months))
+
+    def prefetch_neighbours(self):
+        """Warm the months before and after the anchor. Every arrow step
+        (a day, a week or a month) lands in one of them."""
+        if not self.prefetch:
+            return
+        for delta in (-1, 1):
+            first = add_months(self.anchor, delta)
+            task = asyncio.get_running_loop().create_task(self.month_data(first.year, first.month))
+            self._prefetches.add(task)
+            task.add_done_callback(self._prefetch_done)
+
+    def _prefetch_done(self, task: asyncio.Task):
+        self._prefetches.discard(task)
+        # A failed prefetch is retried when the month is actually shown
+        if not task.cancelled():
+            task.exception()
+
+    async def month_table(self, year: int, month: int) -> MonthTable:
+        return self.cog.month_table(self.settings, year, month, await self.month_data(year, month))
 
     async def entry_for(self, date: datetime.date) -> Optional[Dict]:
         for entry in await self.month_data(date.year, date.month):
@@ -123,19 +210,6 @@ class TimingsView(discord.ui.View):
                 return entry
         return None
 
-    TABLE_HEADER = "          Fajr  Dhuhr Asr   Magh  Isha"
-
-    def table_line(self, entry: Dict, date: datetime.date, label: str) -> str:
-        is_today = date == self.today()
-        marker = '►' if is_today else ' '
-        times = ' '.join(clean_time(entry['timings'][p]) for p in PRAYERS)
-        line = f"{marker} {label}  {times}"
-        if is_today:
-            return ansi(line, '1;37;45')       # white on magenta
-        if date.weekday() == 4:
-            return ansi(line, '0;32')          # green: Jumu'ah
-        return line
-
     async def build_embed(self) -> discord.Embed:
         city = self.settings['city']
         today = self.today()
@@ -150,12 +224,13 @@ class TimingsView(discord.ui.View):
 
         elif self.mode == "weekly":
             start = week_start(self.anchor)
-            lines = [ansi(self.TABLE_HEADER, '0;36')]
+            end = start + datetime.timedelta(days=6)
+            await self.load_months(start, end)
+            lines = [ansi(TABLE_HEADER, '0;36')]
             for offset in range(7):
                 date = start + datetime.timedelta(days=offset)
-                entry = await self.entry_for(date)
-                lines.append(self.table_line(entry, date, date.strftime('%a %d')))
-            end = start + datetime.timedelta(days=6)
+                table = await self.month_table(date.year, date.month)
+                lines.append(table.week_row(date, today))
             embed = discord.Embed(
                 title=f"Adhan Timings ➔ Week of {start.strftime('%d %b')} – {end.strftime('%d %b %Y')}",
                 description="```ansi\n" + "\n".join(lines) + "\n```",
@@ -163,14 +238,10 @@ class TimingsView(discord.ui.View):
             )
 
         else:  # monthly
-            data = await self.month_data(self.anchor.year, self.anchor.month)
-            lines = [ansi(self.TABLE_HEADER, '0;36')]
-            for entry in data:
-                date = datetime.datetime.strptime(entry['date']['gregorian']['date'], '%d-%m-%Y').date()
-                lines.append(self.table_line(entry, date, date.strftime('%d %a')))
+            table = await self.month_table(self.anchor.year, self.anchor.month)
             embed = discord.Embed(
                 title=f"Adhan Timings ➔ {self.anchor.strftime('%B %Y')}",
-                description="```ansi\n" + "\n".join(lines) + "\n```",
+                description=f"```ansi\n{ansi(TABLE_HEADER, '0;36')}\n{table.body(today)}\n```",
                 color=EMBED_COLOR,
             )
 
@@ -184,6 +255,7 @@ class TimingsView(discord.ui.View):
             await interaction.response.send_message(f"Couldn't load timings: {e}. Try again later.", ephemeral=True)
             return
         await interaction.response.edit_message(embed=embed, view=self)
+        self.prefetch_neighbours()
 
     def shift(self, direction: int):
         if self.mode == "daily":
@@ -219,30 +291,42 @@ class TimingsView(discord.ui.View):
 class TimingsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session: Optional[aiohttp.ClientSession] = None
-
-    async def cog_load(self):
-        self.session = aiohttp.ClientSession()
+        # (cell_key, year, month) -> MonthTable, least recently used first
+        self.tables = OrderedDict()
+        # Time until /upcoming acknowledged the interaction, by path taken
+        self.upcoming_latency = LatencyHistogram()
 
-    async def cog_unload(self):
-        if self.session:
-            await self.session.close()
+    def stats(self):
+        return {
+            'tables': len(self.tables),
+            'upcoming_latency': self.upcoming_latency.snapshot(),
+        }
 
     @commands.Cog.listener()
     async def on_ready(self):
         print(f"{__name__} is online")
 
     async def fetch_month(self, settings, year: int, month: int) -> List[Dict]:
-        async with self.session.get(f"{ALADHAN_CALENDAR_URL}/{year}/{month}", params=timings_params(settings)) as response:
-            data = await response.json()
-            if response.status != 200 or data.get('code') != 200:
-                raise Exception("prayer time service unavailable")
-            return data['data']
+        return await self.bot.timings.month(settings, year, month)
+
+    def month_table(self, settings, year: int, month: int, entries: List[Dict]) -> MonthTable:
+        """The parsed, pre-rendered table for a month of timings; one per
+        cell, so everyone in the same city shares it."""
+        key = (cell_key(settings), year, month)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = MonthTable(year, month, entries)
+            while len(self.tables) > TABLE_CACHE_SIZE:
+                self.tables.popitem(last=False)
+        else:
+            self.tables.move_to_end(key)
+        return table
 
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='upcoming', description='View your next upcoming prayer time.')
     async def upcoming(self, interaction: discord.Interaction):
+        began = time.perf_counter()
         user_id = str(interaction.user.id)
 
         settings = await self.bot.db.get_user(user_id)
@@ -251,30 +335,55 @@ class TimingsCog(commands.Cog):
                 await interaction.response.send_message(RESETUP_MESSAGE, ephemeral=True)
                 return
 
-            async with self.session.get(ALADHAN_API_URL, params=timings_params(settings)) as response:
-                data = await response.json()
-                if response.status != 200 or data.get('code') != 200:
-                    await interaction.response.send_message("The prayer time service is unavailable right now. Please try again later.", ephemeral=True)
+            user_timezone = pytz.timezone(settings["timezone"])
+            found = await self.next_prayer_local(user_id, settings, user_timezone)
+            if found is not None:
+                async def send(**kwargs):
+                    # The reply itself is the acknowledgement on this path
+                    await interaction.response.send_message(**kwargs)
+                    self.upcoming_latency.record(time.perf_counter() - began, 'local')
+            else:
+                # Needs the timings service: acknowledge before waiting on it,
+                # so a slow upstream can't miss the 3 s interaction deadline
+                await interaction.response.defer()
+                send = interaction.followup.send
+                self.upcoming_latency.record(time.perf_counter() - began, 'deferred')
+                try:
+                    timings = await self.bot.timings.today(settings)
+                except Exception:
+                    # The defer was public, so a followup can't be ephemeral
+                    await send("The prayer time service is unavailable right now. Please try again later.")
                     return
-                timings = data['data']['timings']
-
-                user_timezone = pytz.timezone(settings["timezone"])
-                next_prayer, next_datetime = next_prayer_datetime(timings, user_timezone)
+                found = next_prayer_datetime(timings, user_timezone)
+            next_prayer, next_datetime = found
 
-                if not next_prayer:
-                    embed = discord.Embed(title="Upcoming Salah", description=f"No upcoming salah times found for {settings['city']}.", color=EMBED_COLOR)
-                    await interaction.response.send_message(embed=embed)
-                    return
+            if not next_prayer:
+                embed = discord.Embed(title="Upcoming Salah", description=f"No upcoming salah times found for {settings['city']}.", color=EMBED_COLOR)
+                await send(embed=embed)
+                return
 
-                next_time_12hr = next_datetime.strftime('%I:%M %p')
-                tomorrow = " tomorrow" if next_datetime.date() != datetime.datetime.now(user_timezone).date() else ""
+            next_time_12hr = next_datetime.strftime('%I:%M %p')
+            tomorrow = " tomorrow" if next_datetime.date() != datetime.datetime.now(user_timezone).date() else ""
 
-                embed = discord.Embed(title="Next Upcoming Salah", description=f"Next upcoming salah for {settings['city']} is {next_prayer} at {next_time_12hr}{tomorrow}.", color=EMBED_COLOR)
-                embed.set_footer(text=f"🕌 Timings for {settings['city']}")
-                await interaction.response.send_message(embed=embed)
+            embed = discord.Embed(title="Next Upcoming Salah", description=f"Next upcoming salah for {settings['city']} is {next_prayer} at {next_time_12hr}{tomorrow}.", color=EMBED_COLOR)
+            embed.set_footer(text=f"🕌 Timings for {settings['city']}")
+            await send(embed=embed)
         else:
             await interaction.response.send_message("Please set up your region using /setup first.")
 
+    async def next_prayer_local(self, user_id, settings, user_timezone):
+        """(prayer, datetime) from data on hand, without the timings service:
+        the user's prayer_schedule rows, else today's timings if their cell's
+        month is in memory. None when neither has it."""
+        scheduled = await self.bot.db.next_scheduled_prayer(user_id)
+        if scheduled:
+            next_prayer, fire_at = scheduled
+            return next_prayer, datetime.datetime.fromtimestamp(fire_at, user_timezone)
+        timings = self.bot.timings.cached_day(settings, datetime.datetime.now(user_timezone).date())
+        if timings is not None:
+            return next_prayer_datetime(timings, user_timezone)
+        return None
+
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.command(name='timings', description='Browse prayer timings: daily, weekly or monthly view.')
@@ -299,6 +408,7 @@ class TimingsCog(commands.Cog):
             await interaction.edit_original_response(content=f"Couldn't load timings: {e}. Try again later.")
             return
         view.message = await interaction.edit_original_response(embed=embed, view=view)
+        view.prefetch_neighbours()
 
 
 async def setup(bot):
@@ -1,7 +1,26 @@
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import sys
+import time
+from collections import OrderedDict
+
 import aiosqlite
+import numpy as np
+import pytz
+
+from prayertimes import ASR_FACTORS, BATCH_PRAYERS, METHOD_PARAMS, batch_inputs, compute_batch
+from events import ChangeBus
+from stats import SettingsStats
 
 DB_FILE = 'user_settings.db'
 
+# Coordinates rounded to one decimal (~11 km grid) identify a shared location
+CELL_DECIMALS = 1
+
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS user_settings (
     user_id            INTEGER PRIMARY KEY,
@@ -10,175 +29,831 @@ CREATE TABLE IF NOT EXISTS user_settings (
     timezone           TEXT NOT NULL DEFAULT 'UTC',
     latitude           REAL,
     longitude          REAL,
+    cell_lat           REAL,
+    cell_lon           REAL,
     asr_method         TEXT NOT NULL DEFAULT '1' CHECK (asr_method IN ('0', '1')),
     calculation_method TEXT NOT NULL DEFAULT '2',
     notify_loop_active INTEGER NOT NULL DEFAULT 0 CHECK (notify_loop_active IN (0, 1)),
+    dm_channel_id      INTEGER,
     created_at         TEXT NOT NULL DEFAULT (datetime('now')),
     updated_at         TEXT NOT NULL DEFAULT (datetime('now'))
 );
+
+CREATE TABLE IF NOT EXISTS prayer_schedule (
+    user_id     INTEGER NOT NULL REFERENCES user_settings(user_id) ON DELETE CASCADE,
+    prayer      TEXT NOT NULL,
+    fire_at_utc INTEGER NOT NULL,
+    PRIMARY KEY (user_id, fire_at_utc)
+);
+
+CREATE INDEX IF NOT EXISTS idx_prayer_schedule_fire_at ON prayer_schedule (fire_at_utc);
+
+-- One month of timings per location cell and method, shared by every user
+-- in the cell (see timings_cache.py); entries is a JSON list, one per day
+CREATE TABLE IF NOT EXISTS timings_months (
+    cell_lat           REAL NOT NULL,
+    cell_lon           REAL NOT NULL,
+    calculation_method TEXT NOT NULL,
+    asr_method         TEXT NOT NULL,
+    timezone           TEXT NOT NULL,
+    source             TEXT NOT NULL,
+    month              INTEGER NOT NULL,  -- year * 12 + month - 1
+    entries            TEXT NOT NULL,
+    fetched_at         TEXT NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (cell_lat, cell_lon, calculation_method, asr_method, timezone, source, month)
+) WITHOUT ROWID;
+"""
+
+# Created after the column migrations in connect(), since older databases
+# only gain the columns these cover there
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_user_settings_cell ON user_settings (cell_lat, cell_lon);
+CREATE INDEX IF NOT EXISTS idx_user_settings_notify_loop ON user_settings (user_id) WHERE notify_loop_active = 1;
 """
 
+# Columns added after the first release: (name, type)
+MIGRATED_COLUMNS = (
+    ('latitude', 'REAL'),
+    ('longitude', 'REAL'),
+    ('dm_channel_id', 'INTEGER'),
+    ('cell_lat', 'REAL'),
+    ('cell_lon', 'REAL'),
+)
+
 UPDATABLE_COLUMNS = {
     'country', 'city', 'timezone', 'latitude', 'longitude',
-    'asr_method', 'calculation_method', 'notify_loop_active',
+    'asr_method', 'calculation_method', 'notify_loop_active', 'dm_channel_id',
 }
 
+# What an upsert (a full /setup) reports as changed to subscribers
+UPSERT_COLUMNS = frozenset(UPDATABLE_COLUMNS - {'dm_channel_id'})
+
+# Changing any of these moves the user's prayer times
+SCHEDULE_COLUMNS = {'timezone', 'latitude', 'longitude', 'asr_method', 'calculation_method'}
+
+# Rows per round trip when loading the presence stats on connect
+STATS_LOAD_CHUNK = 10000
+
+# Columns the presence stats are derived from (latitude/longitude via the cell)
+STATS_COLUMNS = {'country', 'city', 'latitude', 'longitude'}
+
+# How far ahead prayer_schedule is materialized
+SCHEDULE_HORIZON_DAYS = 7
+# Users computed per vectorized pass when extending the schedule
+SCHEDULE_PAGE_SIZE = 5000
+
+# Settings records kept in memory by get_user
+USER_CACHE_SIZE = 10000
+
+# Read-only connections serving reads next to the single writer; 0 sends
+# reads through the writer connection too
+READ_POOL_SIZE = 4
+
+# Group-commit mode: a transaction is committed this many seconds after its
+# first write, or as soon as it holds this many writes
+GROUP_COMMIT_DELAY = 0.005
+GROUP_COMMIT_MAX_WRITES = 200
+
+# Applied to every connection. NORMAL is safe under WAL: a crash can't
+# corrupt the database, only a power cut can drop the last commits.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Stored timings months further back than this are dropped by the daily
+# maintenance pass; /timings can still browse them, they're just refetched
+TIMINGS_RETENTION_MONTHS = 2
+
+# Light maintenance (passive checkpoint, PRAGMA optimize) runs this often;
+# the full pass (truncating checkpoint, ANALYZE, incremental vacuum) runs
+# once a day in this UTC hour, when few users are around
+MAINTENANCE_INTERVAL = 900
+MAINTENANCE_HOUR = 4
+
+
+def geo_cell(latitude, longitude):
+    """The location cell a pair of coordinates falls into."""
+    return round(latitude, CELL_DECIMALS), round(longitude, CELL_DECIMALS)
+
+
+class UserSettings:
+    """One user's settings as Database returns them.
+
+    Slotted and read-only, so the cache can hand the same record to every
+    caller. Fields read as attributes or, like the dicts this replaced, as
+    settings['city'] / settings.get('city').
+    """
+
+    __slots__ = (
+        'user_id', 'country', 'city', 'timezone', 'latitude', 'longitude',
+        'cell_lat', 'cell_lon', 'asr_method', 'calculation_method',
+        'notify_loop_active', 'dm_channel_id',
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSettings records are read-only")
+
+    def __getitem__(self, key):
+        if key not in _SETTINGS_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in _SETTINGS_FIELDS else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return f"UserSettings({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+_SETTINGS_FIELDS = frozenset(UserSettings.__slots__)
+SETTINGS_SELECT = f"SELECT {', '.join(UserSettings.__slots__)} FROM user_settings"
+
 
 def _row_to_settings(row):
-    """Convert a DB row to the settings dict shape the cogs expect."""
+    """Convert a SETTINGS_SELECT row to a UserSettings record.
+
+    Text repeated across users (timezones, countries, cities, method codes)
+    is interned so every record shares one copy of each.
+    """
     if row is None:
         return None
-    settings = dict(row)
-    settings['user_id'] = str(settings['user_id'])
-    settings['notify_loop_active'] = bool(settings['notify_loop_active'])
-    return settings
+    (user_id, country, city, timezone, latitude, longitude, cell_lat, cell_lon,
+     asr_method, calculation_method, notify_loop_active, dm_channel_id) = row
+    return UserSettings(
+        user_id, sys.intern(country), sys.intern(city), sys.intern(timezone),
+        latitude, longitude, cell_lat, cell_lon,
+        sys.intern(asr_method), sys.intern(calculation_method),
+        bool(notify_loop_active), dm_channel_id,
+    )
+
+
+def schedulable(user):
+    """Whether the offline engine knows the user's methods and timezone;
+    logs the ones it doesn't."""
+    if (user['calculation_method'] in METHOD_PARAMS and user['asr_method'] in ASR_FACTORS
+            and user['timezone'] in pytz.all_timezones_set):
+        return True
+    print(
+        f"Not scheduling user {user['user_id']}: unsupported method {user['calculation_method']!r}/"
+        f"{user['asr_method']!r} or timezone {user['timezone']!r}"
+    )
+    return False
+
+
+def schedule_rows(users, start, end):
+    """(user_id, prayer, fire_at_utc) rows for every prayer of the given
+    settings records that falls in [start, end), as epoch seconds.
+
+    Computed offline with the vectorized engine, one pass per local date
+    the window can touch. Users whose method or timezone the engine doesn't
+    know are logged and left without a schedule rather than failing the rest.
+    """
+    users = [user for user in users if user['latitude'] is not None and schedulable(user)]
+    if not users:
+        return []
+    user_ids = np.array([int(user['user_id']) for user in users], dtype=np.int64)
+    prayers = np.array(BATCH_PRAYERS)
+    date = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    last = datetime.datetime.fromtimestamp(end, datetime.timezone.utc).date() + datetime.timedelta(days=1)
+
+    rows = []
+    while date <= last:
+        fire_times = compute_batch(date, **batch_inputs(users, date))
+        with np.errstate(invalid='ignore'):
+            user_index, prayer_index = np.nonzero((fire_times >= start) & (fire_times < end))
+        rows.extend(zip(
+            user_ids[user_index].tolist(),
+            prayers[prayer_index].tolist(),
+            fire_times[user_index, prayer_index].astype(np.int64).tolist(),
+        ))
+        date += datetime.timedelta(days=1)
+    return rows
 
 
 class Database:
-    def __init__(self, path=DB_FILE):
+    """Async access to user_settings, prayer_schedule and timings_months.
+
+    Mutations go through one writer connection. Reads are spread over a
+    pool of read-only connections, each with its own aiosqlite thread, so
+    under WAL they don't queue behind a write in flight; they see committed
+    data only.
+
+    With group_commit=True, writes from many coroutines share one transaction
+    that is committed every few milliseconds instead of one commit per call;
+    each writer still only returns once its own write is durable. Only worth it
+    where commits fsync (synchronous=FULL): under the default NORMAL, WAL
+    commits don't, and batching measures slower (bench.py writes).
+
+    prayer_schedule rows come from schedule_source, an async callable
+    (users, start, end) -> rows such as TimingsCache.schedule_rows, so
+    reminders fire at the times /timings shows. Left as None, they are
+    computed offline with schedule_rows(). A write that moves a user's
+    prayers commits offline rows with the settings and swaps in the
+    source's in the background, so it never waits on a fetch.
+    """
+
+    def __init__(self, path=DB_FILE, cache_size=USER_CACHE_SIZE, group_commit=False,
+                 readers=READ_POOL_SIZE, maintenance_hour=MAINTENANCE_HOUR):
         self.path = path
         self._db = None
+        self.maintenance_hour = maintenance_hour
+        self._maintenance = None
+        self.pool_size = readers
+        self._readers = []
+        self._idle_readers = None
+        self.group_commit = group_commit
+        self.schedule_source = None
+        self._refreshes = set()
+        self._batch = None
+        self._batch_writes = 0
+        self._batch_timer = None
+        self._flushes = set()
+        # Users rescheduled or deleted while extend_schedule runs (else None)
+        self._rescheduled = None
+        # Held for each multi-statement write and each commit, so a commit
+        # never lands between the statements of another coroutine's write
+        self._write_lock = asyncio.Lock()
+        self.commits = 0
+        self.stats = SettingsStats()
+        # Committed user updates/deletions, for whoever holds derived state
+        self.changes = ChangeBus()
+        # user_id -> settings record, or None for users without /setup
+        self._users = OrderedDict()
+        self.cache_size = cache_size
+        # Bumped on every write so a read that raced one isn't cached
+        self._writes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-    async def connect(self):
+    async def connect(self, load_stats=True):
+        """Open the database, creating or migrating the schema. Tools that
+        only need the schema can skip loading the presence stats."""
         self._db = await aiosqlite.connect(self.path)
         self._db.row_factory = aiosqlite.Row
+        # Only takes effect here on a new database; older ones are converted below
+        await self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
         await self._db.execute("PRAGMA journal_mode=WAL")
         await self._db.execute("PRAGMA foreign_keys=ON")
+        for pragma in CONNECTION_PRAGMAS:
+            await self._db.execute(pragma)
         await self._db.executescript(SCHEMA)
         async with self._db.execute("PRAGMA table_info(user_settings)") as cursor:
             existing = {row[1] for row in await cursor.fetchall()}
-        for column in ('latitude', 'longitude'):
+        for column, column_type in MIGRATED_COLUMNS:
             if column not in existing:
-                await self._db.execute(f"ALTER TABLE user_settings ADD COLUMN {column} REAL")
+                await self._db.execute(f"ALTER TABLE user_settings ADD COLUMN {column} {column_type}")
+        await self._backfill_cells()
+        await self._db.executescript(INDEXES)
         await self._db.commit()
+        async with self._db.execute("PRAGMA auto_vacuum") as cursor:
+            if (await cursor.fetchone())[0] != 2:
+                print("Converting database to incremental auto-vacuum (one-time VACUUM)...")
+                await self._db.execute("VACUUM")
+        # Opened after the writer has created the database and its WAL files
+        self._idle_readers = asyncio.Queue()
+        for _ in range(self.pool_size):
+            reader = await aiosqlite.connect(f"{pathlib.Path(self.path).resolve().as_uri()}?mode=ro", uri=True)
+            reader.row_factory = aiosqlite.Row
+            for pragma in CONNECTION_PRAGMAS[1:]:
+                await reader.execute(pragma)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+        if load_stats:
+            # The one full scan; from here on writes keep the stats current
+            async with self._db.execute(
+                "SELECT user_id, country, city, cell_lat, cell_lon, notify_loop_active FROM user_settings"
+            ) as cursor:
+                while rows := await cursor.fetchmany(STATS_LOAD_CHUNK):
+                    for row in rows:
+                        self._track(row)
 
     async def close(self):
+        self.stop_maintenance()
+        for task in list(self._refreshes):
+            task.cancel()
+        if self._refreshes:
+            await asyncio.gather(*self._refreshes, return_exceptions=True)
+        if self._batch is not None:
+            self._flush_batch()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
         if self._db is not None:
+            await self._db.execute("PRAGMA optimize")
             await self._db.close()
             self._db = None
 
+    def start_maintenance(self):
+        if self._maintenance is None:
+            self._maintenance = asyncio.get_running_loop().create_task(self._maintenance_loop())
+
+    def stop_maintenance(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+
+    async def _maintenance_loop(self):
+        last_full = None
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            full = now.hour == self.maintenance_hour and last_full != now.date()
+            try:
+                await self.maintain(full=full)
+            except Exception as e:
+                print(f"Database maintenance failed: {e}")
+                continue
+            if full:
+                last_full = now.date()
+
+    def _file_sizes(self):
+        sizes = {}
+        for suffix in ('', '-wal'):
+            try:
+                sizes[suffix or 'db'] = os.path.getsize(self.path + suffix)
+            except OSError:
+                sizes[suffix or 'db'] = 0
+        return sizes
+
+    async def maintain(self, full=False):
+        """Keep the WAL file and query statistics in check.
+
+        Light: a passive checkpoint (never waits on readers) and PRAGMA
+        optimize. Full: a truncating checkpoint that also shrinks the -wal
+        file, pruning old timings months, ANALYZE and an incremental vacuum
+        of free pages. Writes wait for the pass to finish.
+        """
+        began = time.perf_counter()
+        before = self._file_sizes()
+        freed = 0
+        if self._batch is not None:
+            # Don't make the writers in an open group wait out the checkpoint too
+            self._flush_batch()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        # Optimize and checkpoint fail ("database table is locked") while a
+        # write transaction is open on the connection, so nothing may write
+        # until they're done
+        async with self._write_lock:
+            if self._db.in_transaction:
+                # A group that opened since the flush above; commit it early
+                await self._db.commit()
+            if full:
+                today = datetime.date.today()
+                await self._db.execute(
+                    "DELETE FROM timings_months WHERE month < ?",
+                    (today.year * 12 + today.month - 1 - TIMINGS_RETENTION_MONTHS,),
+                )
+                await self._db.execute("ANALYZE")
+                async with self._db.execute("PRAGMA freelist_count") as cursor:
+                    freed = (await cursor.fetchone())[0]
+                await self._db.commit()
+                # executescript steps the pragma to completion; execute() would free one page
+                await self._db.executescript("PRAGMA incremental_vacuum;")
+            else:
+                await self._db.execute("PRAGMA optimize")
+            # Last, so the vacuumed pages reach the database file before it's truncated
+            mode = 'TRUNCATE' if full else 'PASSIVE'
+            async with self._db.execute(f"PRAGMA wal_checkpoint({mode})") as cursor:
+                busy, wal_pages, checkpointed = await cursor.fetchone()
+        after = self._file_sizes()
+        print(
+            f"Database maintenance ({'full' if full else 'light'}) took {(time.perf_counter() - began) * 1000:.0f} ms: "
+            f"checkpoint {mode.lower()} {checkpointed}/{wal_pages} pages{' (busy)' if busy else ''}, "
+            f"{freed} free pages vacuumed, db {before['db'] // 1024} -> {after['db'] // 1024} KiB, "
+            f"wal {before['-wal'] // 1024} -> {after['-wal'] // 1024} KiB"
+        )
+
+    @contextlib.asynccontextmanager
+    async def _reader(self):
+        """A connection for a read: an idle pooled reader, or the writer
+        when the pool is disabled."""
+        if not self._readers:
+            yield self._db
+            return
+        reader = await self._idle_readers.get()
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
     async def get_user(self, user_id):
-        """Return the user's settings dict, or None if they haven't run /setup."""
+        """Return the user's settings record, or None if they haven't run /setup.
+
+        Read-through: cached records are returned without touching SQLite,
+        and the writers below evict the user's entry.
+        """
+        user_id = int(user_id)
+        if user_id in self._users:
+            self._users.move_to_end(user_id)
+            self.cache_hits += 1
+            return self._users[user_id]
+
+        self.cache_misses += 1
+        writes = self._writes
+        async with self._reader() as db, db.execute(
+            f"{SETTINGS_SELECT} WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            settings = _row_to_settings(await cursor.fetchone())
+        if writes == self._writes:
+            self._cache(user_id, settings)
+        return settings
+
+    def _cache(self, user_id, settings):
+        self._users[user_id] = settings
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.cache_size:
+            self._users.popitem(last=False)
+
+    def cache_stats(self):
+        return {
+            'entries': len(self._users),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+        }
+
+    @contextlib.asynccontextmanager
+    async def _transaction(self):
+        """Run the caller's statements as one write, then commit it alone or
+        with the current group.
+
+        No other write or commit can land between the statements, and a
+        failure rolls back only the caller's own statements (a savepoint in
+        group mode), not the others sharing the group's transaction.
+        """
+        async with self._write_lock:
+            if not self.group_commit:
+                # Each write commits before the lock is released, so the
+                # open transaction is the caller's alone
+                try:
+                    yield self._db
+                except BaseException:
+                    await self._db.rollback()
+                    raise
+                self.commits += 1
+                await self._db.commit()
+                return
+            # A savepoint outside a transaction would commit on RELEASE
+            if not self._db.in_transaction:
+                await self._db.execute("BEGIN")
+            await self._db.execute("SAVEPOINT write")
+            try:
+                yield self._db
+            except BaseException:
+                await self._db.execute("ROLLBACK TO write")
+                await self._db.execute("RELEASE write")
+                if self._batch is None:
+                    # Nobody else is waiting to commit; don't leave it open
+                    await self._db.commit()
+                raise
+            await self._db.execute("RELEASE write")
+        await self._commit()
+
+    async def _commit(self):
+        """Join the current commit group (group_commit mode only; see
+        _transaction)."""
+        if self._batch is None:
+            loop = asyncio.get_running_loop()
+            self._batch = loop.create_future()
+            self._batch_timer = loop.call_later(GROUP_COMMIT_DELAY, self._flush_batch)
+        batch = self._batch
+        self._batch_writes += 1
+        if self._batch_writes >= GROUP_COMMIT_MAX_WRITES:
+            self._flush_batch()
+        # A cancelled writer must not cancel the commit the others share
+        await asyncio.shield(batch)
+
+    def _flush_batch(self):
+        batch, self._batch, self._batch_writes = self._batch, None, 0
+        self._batch_timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._commit_batch(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _commit_batch(self, batch):
+        self.commits += 1
+        try:
+            async with self._write_lock:
+                await self._db.commit()
+        except Exception as e:
+            batch.set_exception(e)
+        else:
+            batch.set_result(None)
+
+    async def _backfill_cells(self):
+        """Fill cell_lat/cell_lon for rows written before they existed."""
         async with self._db.execute(
-            "SELECT * FROM user_settings WHERE user_id = ?", (int(user_id),)
+            "SELECT user_id, latitude, longitude FROM user_settings "
+            "WHERE latitude IS NOT NULL AND cell_lat IS NULL"
         ) as cursor:
-            return _row_to_settings(await cursor.fetchone())
+            rows = await cursor.fetchall()
+        await self._db.executemany(
+            "UPDATE user_settings SET cell_lat = ?, cell_lon = ? WHERE user_id = ?",
+            [(*geo_cell(row['latitude'], row['longitude']), row['user_id']) for row in rows],
+        )
+
+    def _track(self, row):
+        cell = (row['cell_lat'], row['cell_lon']) if row['cell_lat'] is not None else None
+        self.stats.set(row['user_id'], row['country'], row['city'], cell, row['notify_loop_active'])
+
+    def _invalidate(self, user_id):
+        self._writes += 1
+        self._users.pop(int(user_id), None)
 
     async def upsert_user(self, user_id, *, country, city, timezone,
                           asr_method, calculation_method,
-                          latitude=None, longitude=None):
-        """Create or fully replace a user's region settings (used by /setup).
+                          latitude=None, longitude=None, notify_loop_active=False):
+        """Create or fully replace a user's settings in one transaction, with
+        their schedule regenerated once (used by /setup). Returns the new
+        settings record.
 
-        Re-running /setup resets notify_loop_active, matching the old
-        behaviour where the whole settings dict was overwritten.
+        A dm_channel_id already known is kept; everything else is replaced,
+        so re-running /setup without opting in turns the loop off.
         """
-        await self._db.execute(
-            """
-            INSERT INTO user_settings
-                (user_id, country, city, timezone, latitude, longitude,
-                 asr_method, calculation_method)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                country            = excluded.country,
-                city               = excluded.city,
-                timezone           = excluded.timezone,
-                latitude           = excluded.latitude,
-                longitude          = excluded.longitude,
-                asr_method         = excluded.asr_method,
-                calculation_method = excluded.calculation_method,
-                notify_loop_active = 0,
-                updated_at         = datetime('now')
-            """,
-            (int(user_id), country, city, timezone, latitude, longitude,
-             asr_method, calculation_method),
-        )
-        await self._db.commit()
+        cell_lat, cell_lon = geo_cell(latitude, longitude) if latitude is not None else (None, None)
+        writes = self._writes
+        async with self._transaction() as db:
+            async with db.execute(
+                f"""
+                INSERT INTO user_settings
+                    (user_id, country, city, timezone, latitude, longitude,
+                     cell_lat, cell_lon, asr_method, calculation_method, notify_loop_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    country            = excluded.country,
+                    city               = excluded.city,
+                    timezone           = excluded.timezone,
+                    latitude           = excluded.latitude,
+                    longitude          = excluded.longitude,
+                    cell_lat           = excluded.cell_lat,
+                    cell_lon           = excluded.cell_lon,
+                    asr_method         = excluded.asr_method,
+                    calculation_method = excluded.calculation_method,
+                    notify_loop_active = excluded.notify_loop_active,
+                    updated_at         = datetime('now')
+                RETURNING {', '.join(UserSettings.__slots__)}
+                """,
+                (int(user_id), country, city, timezone, latitude, longitude,
+                 cell_lat, cell_lon, asr_method, calculation_method, int(bool(notify_loop_active))),
+            ) as cursor:
+                settings = _row_to_settings(await cursor.fetchone())
+            await self._replace_schedule(user_id, self._offline_schedule(settings))
+        self._refresh_schedule_later(settings)
+        self._track(settings)
+        self._invalidate(user_id)
+        # Write-through, unless another write landed in the meantime
+        if self._writes == writes + 1:
+            self._cache(settings.user_id, settings)
+        self.changes.publish('updated', settings.user_id, settings, UPSERT_COLUMNS)
+        return settings
 
     async def update_user(self, user_id, **fields):
-        """Update individual columns for an existing user."""
+        """Update individual columns for an existing user. Returns the new
+        settings record, or None if the user doesn't exist."""
         invalid = set(fields) - UPDATABLE_COLUMNS
         if invalid:
             raise ValueError(f"Cannot update columns: {', '.join(sorted(invalid))}")
         if 'notify_loop_active' in fields:
             fields['notify_loop_active'] = int(bool(fields['notify_loop_active']))
+        if 'latitude' in fields or 'longitude' in fields:
+            if not {'latitude', 'longitude'} <= set(fields):
+                raise ValueError("latitude and longitude must be updated together")
+            located = fields['latitude'] is not None
+            fields['cell_lat'], fields['cell_lon'] = (
+                geo_cell(fields['latitude'], fields['longitude']) if located else (None, None)
+            )
         assignments = ', '.join(f"{column} = ?" for column in fields)
-        await self._db.execute(
-            f"UPDATE user_settings SET {assignments}, updated_at = datetime('now') "
-            "WHERE user_id = ?",
-            (*fields.values(), int(user_id)),
-        )
-        await self._db.commit()
+        rescheduled = bool(SCHEDULE_COLUMNS & set(fields))
+        writes = self._writes
+        async with self._transaction() as db:
+            async with db.execute(
+                f"UPDATE user_settings SET {assignments}, updated_at = datetime('now') "
+                f"WHERE user_id = ? RETURNING {', '.join(UserSettings.__slots__)}",
+                (*fields.values(), int(user_id)),
+            ) as cursor:
+                settings = _row_to_settings(await cursor.fetchone())
+            if settings is not None and rescheduled:
+                await self._replace_schedule(user_id, self._offline_schedule(settings))
+        self._invalidate(user_id)
+        if settings is not None:
+            if rescheduled:
+                self._refresh_schedule_later(settings)
+            if STATS_COLUMNS & set(fields):
+                self._track(settings)
+            elif 'notify_loop_active' in fields:
+                self.stats.set_active(settings.user_id, settings.notify_loop_active)
+            if self._writes == writes + 1:
+                self._cache(settings.user_id, settings)
+            self.changes.publish('updated', settings.user_id, settings, frozenset(fields))
+        return settings
+
+    async def get_timings_month(self, key, source, year, month):
+        """Stored entries for a timings_cache.cell_key and month, or None."""
+        async with self._reader() as db, db.execute(
+            "SELECT entries FROM timings_months WHERE cell_lat = ? AND cell_lon = ? "
+            "AND calculation_method = ? AND asr_method = ? AND timezone = ? AND source = ? AND month = ?",
+            (*key, source, year * 12 + month - 1),
+        ) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def put_timings_month(self, key, source, year, month, entries):
+        async with self._transaction() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO timings_months "
+                "(cell_lat, cell_lon, calculation_method, asr_method, timezone, source, month, entries) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, source, year * 12 + month - 1, json.dumps(entries, separators=(',', ':'))),
+            )
 
     async def count_users(self):
         """Number of users who have completed /setup."""
-        async with self._db.execute("SELECT COUNT(*) FROM user_settings") as cursor:
+        async with self._reader() as db, db.execute("SELECT COUNT(*) FROM user_settings") as cursor:
             return (await cursor.fetchone())[0]
 
-    async def get_stats(self):
-        """Aggregate numbers for presence displays.
+    def get_stats(self):
+        """Aggregate numbers for presence displays, maintained incrementally
+        (see stats.SettingsStats) so this never touches SQLite."""
+        return self.stats.snapshot()
+
+    async def delete_user(self, user_id):
+        """Remove a user's settings entirely; their prayer_schedule rows go
+        with them (ON DELETE CASCADE), which stops their notifications."""
+        async with self._transaction() as db:
+            await db.execute("DELETE FROM user_settings WHERE user_id = ?", (int(user_id),))
+            if self._rescheduled is not None:
+                self._rescheduled.add(int(user_id))
+        self.stats.discard(int(user_id))
+        self._invalidate(user_id)
+        self.changes.publish('deleted', int(user_id))
+
+    async def iter_user_pages(self, page_size=1000, *, notify_loop_active=None,
+                              timezone=None, cell=None, calculation_method=None):
+        """Yield lists of up to page_size settings records, keyset-paginated
+        by user_id, so bulk jobs never hold every user at once.
 
-        Cities are clustered by coordinate cells (~11 km grid) rather than by
-        the stored text, so spelling variants of the same place count once.
+        Optional filters: notify_loop_active (bool), timezone, cell (a
+        geo_cell() pair) and calculation_method.
         """
-        async with self._db.execute(
-            """
-            SELECT COUNT(*),
-                   COUNT(DISTINCT LOWER(TRIM(country))),
-                   COALESCE(SUM(notify_loop_active), 0)
-            FROM user_settings
-            """
-        ) as cursor:
-            users, countries, active_loops = await cursor.fetchone()
+        conditions, params = ["user_id > ?"], []
+        if notify_loop_active is not None:
+            # Spelled as a literal so the partial index applies
+            conditions.append(f"notify_loop_active = {int(bool(notify_loop_active))}")
+        if timezone is not None:
+            conditions.append("timezone = ?")
+            params.append(timezone)
+        if cell is not None:
+            conditions.append("cell_lat = ? AND cell_lon = ?")
+            params.extend(cell)
+        if calculation_method is not None:
+            conditions.append("calculation_method = ?")
+            params.append(calculation_method)
+        query = f"{SETTINGS_SELECT} WHERE {' AND '.join(conditions)} ORDER BY user_id LIMIT ?"
 
-        async with self._db.execute(
-            """
-            SELECT COUNT(DISTINCT ROUND(latitude, 1) || ',' || ROUND(longitude, 1))
-            FROM user_settings WHERE latitude IS NOT NULL
-            """
-        ) as cursor:
-            cities = (await cursor.fetchone())[0]
+        after = -1
+        while True:
+            async with self._reader() as db, db.execute(query, (after, *params, page_size)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+            yield [_row_to_settings(row) for row in rows]
+            after = rows[-1]['user_id']
 
-        top_city, top_city_users = None, 0
-        async with self._db.execute(
-            """
-            SELECT ROUND(latitude, 1) AS cell_lat, ROUND(longitude, 1) AS cell_lon, COUNT(*) AS c
-            FROM user_settings WHERE latitude IS NOT NULL
-            GROUP BY cell_lat, cell_lon
-            ORDER BY c DESC LIMIT 1
-            """
+    async def iter_users(self, page_size=1000, **filters):
+        """Yield settings records one at a time; see iter_user_pages()."""
+        async for page in self.iter_user_pages(page_size, **filters):
+            for settings in page:
+                yield settings
+
+    async def _schedule_rows(self, users, start, end):
+        if self.schedule_source is not None:
+            return await self.schedule_source(users, start, end)
+        # A page takes a noticeable slice of a second; keep it off the event loop
+        return await asyncio.to_thread(schedule_rows, users, start, end)
+
+    async def _user_schedule(self, settings):
+        """One user's schedule rows from now to the horizon."""
+        now = time.time()
+        return await self._schedule_rows([settings], now, now + SCHEDULE_HORIZON_DAYS * 86400)
+
+    def _offline_schedule(self, settings):
+        """One user's rows from now to the horizon by the offline engine,
+        quick enough to compute inside a write."""
+        now = time.time()
+        return schedule_rows([settings], now, now + SCHEDULE_HORIZON_DAYS * 86400)
+
+    def _refresh_schedule_later(self, settings):
+        """Replace the offline rows just committed for the user with the
+        schedule_source's, off the writer's path: a fetch can take seconds,
+        and /setup's components have to answer Discord within three."""
+        if self.schedule_source is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._refresh_schedule(settings))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def _refresh_schedule(self, settings):
+        basis = {column: settings[column] for column in SCHEDULE_COLUMNS}
+        try:
+            rows = await self._user_schedule(settings)
+            async with self._transaction() as db:
+                # Changed or deleted since; a later write handles its own
+                current = await self._schedule_basis(db, settings.user_id) == basis
+                if current:
+                    await self._replace_schedule(settings.user_id, rows)
+        except Exception as e:
+            print(f"Error refreshing schedule for user {settings.user_id}: {e}")
+            return
+        if current:
+            self.changes.publish('rescheduled', settings.user_id, settings)
+
+    async def _schedule_basis(self, db, user_id):
+        """The user's current SCHEDULE_COLUMNS, or None if they don't exist."""
+        async with db.execute(
+            f"SELECT {', '.join(sorted(SCHEDULE_COLUMNS))} FROM user_settings WHERE user_id = ?", (int(user_id),)
         ) as cursor:
-            cell = await cursor.fetchone()
-        if cell:
-            top_city_users = cell['c']
+            row = await cursor.fetchone()
+        return dict(zip(sorted(SCHEDULE_COLUMNS), row)) if row else None
 
-            async with self._db.execute(
-                """
-                SELECT city FROM user_settings
-                WHERE ROUND(latitude, 1) = ? AND ROUND(longitude, 1) = ?
-                GROUP BY LOWER(TRIM(city)) ORDER BY COUNT(*) DESC LIMIT 1
-                """,
-                (cell['cell_lat'], cell['cell_lon']),
-            ) as cursor:
-                top_city = (await cursor.fetchone())['city']
+    async def _replace_schedule(self, user_id, rows):
+        """Replace one user's schedule rows. Runs inside the caller's
+        _transaction, so settings and schedule are committed together."""
+        await self._db.execute("DELETE FROM prayer_schedule WHERE user_id = ?", (int(user_id),))
+        if self._rescheduled is not None:
+            self._rescheduled.add(int(user_id))
+        await self._db.executemany(
+            "INSERT OR IGNORE INTO prayer_schedule (user_id, prayer, fire_at_utc) VALUES (?, ?, ?)", rows,
+        )
 
-        return {
-            'users': users,
-            'countries': countries,
-            'cities': cities,
-            'active_loops': active_loops,
-            'top_city': top_city,
-            'top_city_users': top_city_users,
-        }
+    async def extend_schedule(self):
+        """Roll the schedule forward: drop past rows and fill every user's
+        prayers up to the horizon. Returns the number of rows added.
 
-    async def delete_user(self, user_id):
-        """Remove a user's settings entirely. Active notification loops stop
-        on their own once get_user starts returning None."""
-        await self._db.execute("DELETE FROM user_settings WHERE user_id = ?", (int(user_id),))
-        await self._db.commit()
+        Pages are read and computed outside the writer lock, so a user's
+        settings can change before their rows are written. Those users had
+        their schedule regenerated from the new settings (or were deleted)
+        in the meantime; their rows from the older page are dropped.
+        """
+        now = time.time()
+        added = 0
+        # Tracked from before the first commit below: once it's done, every
+        # earlier write is committed and visible to the pages read after it
+        self._rescheduled = set()
+        try:
+            async with self._transaction() as db:
+                await db.execute("DELETE FROM prayer_schedule WHERE fire_at_utc <= ?", (int(now),))
+            async for users in self.iter_user_pages(SCHEDULE_PAGE_SIZE):
+                rows = await self._schedule_rows(users, now, now + SCHEDULE_HORIZON_DAYS * 86400)
+                async with self._transaction() as db:
+                    if self._rescheduled:
+                        rows = [row for row in rows if row[0] not in self._rescheduled]
+                    cursor = await db.executemany(
+                        "INSERT OR IGNORE INTO prayer_schedule (user_id, prayer, fire_at_utc) VALUES (?, ?, ?)",
+                        rows,
+                    )
+                added += cursor.rowcount
+        finally:
+            self._rescheduled = None
+        return added
 
-    async def get_notify_loop_users(self):
-        """Return settings for every user with an active notification loop."""
-        async with self._db.execute(
-            "SELECT * FROM user_settings WHERE notify_loop_active = 1"
+    async def get_due_prayers(self, after, until):
+        """Scheduled prayers of active notification loops in (after, until], as
+        (user_id, prayer, fire_at_utc, city, timezone, dm_channel_id)."""
+        async with self._reader() as db, db.execute(
+            """
+            SELECT s.user_id, s.prayer, s.fire_at_utc, u.city, u.timezone, u.dm_channel_id
+            FROM prayer_schedule s JOIN user_settings u ON u.user_id = s.user_id
+            WHERE s.fire_at_utc > ? AND s.fire_at_utc <= ? AND u.notify_loop_active = 1
+            ORDER BY s.fire_at_utc
+            """,
+            (int(after), int(until)),
+        ) as cursor:
+            return [
+                (row['user_id'], row['prayer'], row['fire_at_utc'], row['city'], row['timezone'], row['dm_channel_id'])
+                for row in await cursor.fetchall()
+            ]
+
+    async def next_scheduled_prayer(self, user_id, after=None):
+        """(prayer, fire_at_utc) of the user's next scheduled salah, or None."""
+        async with self._reader() as db, db.execute(
+            """
+            SELECT prayer, fire_at_utc FROM prayer_schedule
+            WHERE user_id = ? AND fire_at_utc > ?
+            ORDER BY fire_at_utc LIMIT 1
+            """,
+            (int(user_id), int(time.time() if after is None else after)),
         ) as cursor:
-            return [_row_to_settings(row) for row in await cursor.fetchall()]
+            row = await cursor.fetchone()
+        return (row['prayer'], row['fire_at_utc']) if row else None
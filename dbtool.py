@@ -0,0 +1,210 @@
+"""Move user_settings between hosts and take backups.
+
+    python dbtool.py export users.ndjson          # or users.csv; '-' for stdout
+    python dbtool.py import users.ndjson          # upserts; run with the bot stopped
+    python dbtool.py snapshot backup.db           # consistent copy of the live database
+
+The format follows the file extension unless --format is given. Exports and
+imports stream in chunks, so memory use doesn't grow with the table. An
+import drops the imported users' prayer_schedule rows, which may be for an
+old location; the bot's next schedule extension, at startup, builds them
+again from the imported settings.
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import operator
+import os
+import sqlite3
+import sys
+import time
+
+from database import DB_FILE, Database, geo_cell
+
+# Everything a user row holds; cell_lat/cell_lon are derived on import
+COLUMNS = (
+    'user_id', 'country', 'city', 'timezone', 'latitude', 'longitude',
+    'asr_method', 'calculation_method', 'notify_loop_active', 'dm_channel_id',
+    'created_at', 'updated_at',
+)
+# How to turn CSV text back into column values; empty means NULL
+CONVERTERS = {
+    'user_id': int,
+    'latitude': float,
+    'longitude': float,
+    'notify_loop_active': int,
+    'dm_channel_id': int,
+}
+REQUIRED = ('user_id', 'country', 'city')
+# Filled in by SQL when a record leaves them out, as the table defaults would
+DEFAULTS = {
+    'timezone': "'UTC'",
+    'asr_method': "'1'",
+    'calculation_method': "'2'",
+    'notify_loop_active': '0',
+    'created_at': "datetime('now')",
+    'updated_at': "datetime('now')",
+}
+CHUNK_SIZE = 50_000
+
+UPSERT = f"""
+INSERT INTO user_settings ({', '.join(COLUMNS)}, cell_lat, cell_lon)
+VALUES ({', '.join(f'COALESCE(?, {DEFAULTS[column]})' if column in DEFAULTS else '?' for column in COLUMNS)}, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:])},
+    cell_lat = excluded.cell_lat,
+    cell_lon = excluded.cell_lon
+"""
+
+
+def detect_format(path, given):
+    if given:
+        return given
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    raise SystemExit(f"Can't tell the format of {path!r}; pass --format csv or --format ndjson")
+
+
+def open_text(path, mode):
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def export_users(db_path, path, file_format):
+    # A read-only connection reads one consistent WAL snapshot without
+    # blocking the bot's writer
+    connection = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    cursor = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM user_settings ORDER BY user_id")
+    count = 0
+    out = open_text(path, 'w')
+    try:
+        if file_format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(COLUMNS)
+        while rows := cursor.fetchmany(CHUNK_SIZE):
+            if file_format == 'csv':
+                writer.writerows(rows)
+            else:
+                out.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        connection.close()
+    return count
+
+
+def read_records(handle, file_format):
+    """Yield one dict per user from an NDJSON or CSV stream."""
+    if file_format == 'csv':
+        for record in csv.DictReader(handle):
+            yield {
+                column: (CONVERTERS.get(column, str)(value) if value != '' else None)
+                for column, value in record.items() if column in COLUMNS
+            }
+    else:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+_pick_columns = operator.itemgetter(*COLUMNS)
+
+
+def to_row(record, line):
+    try:
+        # Our own exports carry every column
+        row = _pick_columns(record)
+    except KeyError:
+        row = tuple(record.get(column) for column in COLUMNS)
+    if None in row[:len(REQUIRED)]:
+        missing = [column for column in REQUIRED if record.get(column) is None]
+        raise SystemExit(f"Record {line} is missing {', '.join(missing)}")
+    latitude, longitude = row[4], row[5]
+    cell = geo_cell(latitude, longitude) if latitude is not None and longitude is not None else (None, None)
+    return (*row, *cell)
+
+
+def import_users(db_path, path, file_format):
+    # Let Database create or migrate the schema first
+    async def prepare():
+        db = Database(db_path, readers=0)
+        await db.connect(load_stats=False)
+        await db.close()
+    asyncio.run(prepare())
+
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    connection.execute("PRAGMA synchronous=NORMAL")
+    count = 0
+    handle = open_text(path, 'r')
+    try:
+        rows = (to_row(record, line) for line, record in enumerate(read_records(handle, file_format), 1))
+        while chunk := list(itertools.islice(rows, CHUNK_SIZE)):
+            connection.execute("BEGIN")
+            connection.executemany(UPSERT, chunk)
+            # extend_schedule only adds rows, so stale ones would fire alongside
+            connection.executemany("DELETE FROM prayer_schedule WHERE user_id = ?", [(row[0],) for row in chunk])
+            connection.execute("COMMIT")
+            count += len(chunk)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+        connection.close()
+    return count
+
+
+def snapshot(db_path, destination):
+    """Copy the live database with SQLite's online backup API.
+
+    The copy is taken in a single step, i.e. one read transaction: under WAL
+    that sees a consistent state and never blocks the bot's writer.
+    """
+    source = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    target = sqlite3.connect(destination)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_FILE, help=f'database path (default {DB_FILE})')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='write user_settings to NDJSON or CSV')
+    export.add_argument('path')
+    export.add_argument('--format', choices=('ndjson', 'csv'))
+
+    load = commands.add_parser('import', help='upsert users from NDJSON or CSV')
+    load.add_argument('path')
+    load.add_argument('--format', choices=('ndjson', 'csv'))
+
+    backup = commands.add_parser('snapshot', help='hot backup of the database file')
+    backup.add_argument('destination')
+
+    args = parser.parse_args()
+    began = time.perf_counter()
+    if args.command == 'export':
+        count = export_users(args.db, args.path, detect_format(args.path, args.format))
+        print(f"exported {count} users in {time.perf_counter() - began:.1f} s", file=sys.stderr)
+    elif args.command == 'import':
+        if not args.format and args.path == '-':
+            raise SystemExit("Pass --format when importing from stdin")
+        count = import_users(args.db, args.path, detect_format(args.path, args.format))
+        print(f"imported {count} users in {time.perf_counter() - began:.1f} s", file=sys.stderr)
+    elif args.command == 'snapshot':
+        if os.path.exists(args.destination):
+            raise SystemExit(f"{args.destination} already exists")
+        snapshot(args.db, args.destination)
+        print(f"snapshot written to {args.destination} in {time.perf_counter() - began:.1f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import collections
+import itertools
+import time
+
+import discord
+
+# Discord allows 50 requests/s globally per bot; stay a little under it.
+# Its per-route limit on posting a message is per channel, and a reminder
+# is one message per DM channel, so the global budget is the one that binds.
+GLOBAL_RATE = 45
+# Small enough that burst plus a second's refill stays within 50
+GLOBAL_BURST = 5
+WORKERS = 16
+MAX_QUEUED = 20000
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 5
+
+# Lower sorts first: sends on their way out on time beat retries
+ON_TIME = 0
+RETRY = 1
+
+# How many recent sends the latency/lateness percentiles are taken over
+SAMPLE_SIZE = 2000
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class DispatchQueue:
+    """Bounded, prioritized DM pipeline that smooths send spikes.
+
+    Everyone whose Maghrib falls in the same minute lands here at once;
+    a fixed pool of workers drains the queue through a global token bucket,
+    one token per REST call, so we stay inside Discord's rate limit instead
+    of tripping 429 storms. send() resolves once the DM went out, or raises
+    what the final attempt raised.
+
+    The worker takes the token for posting the message, and a second one
+    when the destination is a discord.py user without an open DM channel
+    (it opens one first). Destinations that make other calls of their own,
+    like cogs.notification.LazyDM, pace them with acquire().
+    """
+
+    def __init__(self, workers=WORKERS, max_queued=MAX_QUEUED):
+        self.workers = workers
+        self._queue = asyncio.PriorityQueue(maxsize=max_queued)
+        self._counter = itertools.count()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._tasks = []
+        self._retries = set()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.send_latency = collections.deque(maxlen=SAMPLE_SIZE)
+        self.lateness = collections.deque(maxlen=SAMPLE_SIZE)
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks + list(self._retries):
+            task.cancel()
+        self._tasks = []
+
+    async def acquire(self):
+        """Wait for one REST call's share of the global budget."""
+        await self._global.acquire()
+
+    async def send(self, destination, content=None, *, due_at=None, **kwargs):
+        """Queue a message for `destination` (anything with .send) and wait
+        until it has been delivered.
+
+        due_at is the epoch time the message is about (the prayer time); how
+        far behind it the message actually went out is tracked as lateness.
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = (destination, content, kwargs, due_at, future)
+        await self._put(ON_TIME, due_at, job, 1)
+        return await future
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'retrying': len(self._retries),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'send_latency_p50_ms': _ms(percentile(self.send_latency, 0.5)),
+            'send_latency_p99_ms': _ms(percentile(self.send_latency, 0.99)),
+            'lateness_p50_s': percentile(self.lateness, 0.5),
+            'lateness_p99_s': percentile(self.lateness, 0.99),
+            'lateness_max_s': max(self.lateness) if self.lateness else None,
+        }
+
+    async def _put(self, priority, due_at, job, attempt):
+        order = due_at if due_at is not None else time.time()
+        await self._queue.put((priority, order, next(self._counter), job, attempt))
+
+    async def _retry_later(self, job, attempt):
+        await asyncio.sleep(RETRY_DELAY * attempt)
+        await self._put(RETRY, job[3], job, attempt + 1)
+
+    async def _worker(self):
+        while True:
+            _, _, _, job, attempt = await self._queue.get()
+            destination, content, kwargs, due_at, future = job
+            try:
+                if future.done():
+                    continue
+                await self._global.acquire()
+                if getattr(destination, 'dm_channel', False) is None:
+                    # discord.py calls create_dm before posting
+                    await self._global.acquire()
+
+                started = time.monotonic()
+                try:
+                    await destination.send(content, **kwargs)
+                except (discord.Forbidden, discord.NotFound) as e:
+                    # Permanent: retrying won't help
+                    self.failed += 1
+                    future.set_exception(e)
+                    continue
+                except (discord.HTTPException, asyncio.TimeoutError, OSError) as e:
+                    status = getattr(e, 'status', None)
+                    if attempt < MAX_ATTEMPTS and (status is None or status == 429 or status >= 500):
+                        self.retried += 1
+                        task = asyncio.get_running_loop().create_task(self._retry_later(job, attempt))
+                        self._retries.add(task)
+                        task.add_done_callback(self._retries.discard)
+                    else:
+                        self.failed += 1
+                        future.set_exception(e)
+                    continue
+
+                self.sent += 1
+                self.send_latency.append(time.monotonic() - started)
+                if due_at is not None:
+                    self.lateness.append(max(0.0, time.time() - due_at))
+                future.set_result(None)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
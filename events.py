@@ -0,0 +1,36 @@
+class ChangeBus:
+    """In-process fan-out of user settings changes.
+
+    Database publishes after each committed write, so subscribers react the
+    moment something changes instead of re-reading settings on a timer.
+    Subscribers are plain callables run synchronously, in subscription order:
+
+        callback(kind, user_id, settings, fields)
+
+    kind is 'updated' or 'deleted'; settings is the committed record (None
+    for deletions) and fields the set of columns the write touched.
+    'rescheduled' follows an update when the user's prayer_schedule rows
+    were later replaced from the timings source, with the settings they
+    were built from and no fields. A failing subscriber is logged and
+    doesn't stop the others.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self.published = 0
+
+    def subscribe(self, callback):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def publish(self, kind, user_id, settings=None, fields=frozenset()):
+        self.published += 1
+        for callback in list(self._subscribers):
+            try:
+                callback(kind, user_id, settings, fields)
+            except Exception as e:
+                print(f"Error in settings change subscriber {getattr(callback, '__qualname__', callback)}: {e}")
@@ -0,0 +1,190 @@
+"""Offline Hijri <-> Gregorian conversion, for the /calendar command.
+
+Dates from 1343 to 1500 AH (1924-2077) follow the Umm al-Qura calendar of
+Saudi Arabia; outside that range the tabular (arithmetic) Islamic calendar
+takes over, which only matters for browsing far back or ahead. Aladhan's
+hToGCalendar defaults to HJCoSA, the Saudi High Judicial Court's
+sighting-adjusted dates, which can start a month a day away from Umm
+al-Qura (bench.py hijri --recorded counts the days). month_days()
+returns a month in the shape of Aladhan's /v1/hToGCalendar response, so the
+calendar cog renders it as it did the API's.
+"""
+import datetime
+import math
+
+UMM_AL_QURA_FIRST_YEAR = 1343
+# Gregorian day of 1 Muharram 1343 AH
+UMM_AL_QURA_EPOCH = datetime.date(1924, 8, 1).toordinal()
+# One entry per year from 1343 AH: bit n set means month n + 1 has 30 days,
+# clear means 29
+UMM_AL_QURA_MONTHS = (
+    0xeed, 0x554, 0xb45, 0x66c, 0x36c, 0x0d5, 0x9d5, 0xb4a, 0xb15, 0x555,
+    0x9ad, 0x56a, 0xb55, 0x4d4, 0xd55, 0x64b, 0x497, 0xd55, 0x555, 0x555,
+    0xd55, 0x755, 0xd55, 0x555, 0x555, 0xd55, 0x6d5, 0x555, 0xea5, 0xd2a,
+    0xaaa, 0xcd5, 0x655, 0x572, 0xda9, 0x555, 0xaaa, 0x555, 0x52d, 0xa6d,
+    0x55a, 0x555, 0x74d, 0xd53, 0xd54, 0x556, 0xd55, 0x2d5, 0xd55, 0xd54,
+    0xd45, 0x655, 0x52d, 0xa5d, 0x55a, 0xad5, 0x6aa, 0xd4b, 0x52a, 0xa57,
+    0x4ae, 0x976, 0x56c, 0xb55, 0xaaa, 0xa55, 0x4ad, 0x95d, 0x2da, 0x5d9,
+    0xdb2, 0xba4, 0xb4a, 0xa55, 0x2b5, 0x575, 0xb6a, 0xbd2, 0xbc4, 0xb89,
+    0xa95, 0x52d, 0x5ad, 0xb6a, 0x6d4, 0xdc9, 0xd92, 0xaa6, 0x956, 0x2ae,
+    0x56d, 0x36a, 0xb55, 0xaaa, 0x94d, 0x49d, 0x95d, 0x2ba, 0x5b5, 0x5aa,
+    0xd55, 0xa9a, 0x92e, 0x26e, 0x55d, 0xada, 0x6d4, 0x6a5, 0x54b, 0xa97,
+    0x54e, 0xaae, 0x5ac, 0xba9, 0xd92, 0xb25, 0x64b, 0xcab, 0x55a, 0xb55,
+    0x6d2, 0xea5, 0xe4a, 0xa95, 0x52d, 0xaad, 0x36c, 0x759, 0x6d2, 0x695,
+    0x52d, 0xa5b, 0x4ba, 0x9ba, 0x3b4, 0xb69, 0xb52, 0xaa6, 0x4b6, 0x96d,
+    0x2ec, 0x6d9, 0xeb2, 0xd54, 0xd2a, 0xa56, 0x4ae, 0x96d, 0xd6a, 0xb54,
+    0xb29, 0xa93, 0x52b, 0xa57, 0x536, 0xab5, 0x6aa, 0xe93,
+)
+# Early months the published calendar gives 28 or 31 days
+UMM_AL_QURA_IRREGULAR = {
+    (1343, 9): 28, (1345, 5): 31, (1345, 8): 28, (1348, 11): 31,
+    (1348, 12): 28, (1349, 10): 28, (1349, 11): 31, (1364, 8): 28,
+}
+UMM_AL_QURA_LAST_YEAR = UMM_AL_QURA_FIRST_YEAR + len(UMM_AL_QURA_MONTHS) - 1
+
+# Day before 1 Muharram 1 AH (16 July 622, Julian) in the tabular calendar
+TABULAR_EPOCH = datetime.date(622, 7, 19).toordinal() - 1
+
+# Month names as Aladhan spells them
+MONTHS_EN = (
+    "Muḥarram", "Ṣafar", "Rabīʿ al-awwal", "Rabīʿ al-thānī", "Jumādá al-ūlá", "Jumādá al-ākhirah",
+    "Rajab", "Shaʿbān", "Ramaḍān", "Shawwāl", "Dhū al-Qaʿdah", "Dhū al-Ḥijjah",
+)
+
+# (month, day) -> holiday, as named in Aladhan's feed
+HOLIDAYS = {
+    (1, 10): "Ashura",
+    (3, 12): "Mawlid al-Nabi",
+    (7, 1): "Beginning of the holy months",
+    (7, 27): "Lailat-ul-Miraj",
+    (8, 15): "Lailat-ul-Bara'at",
+    (9, 1): "1st Day of Ramadan",
+    (10, 1): "Eid-ul-Fitr",
+    (12, 9): "Arafa",
+    (12, 10): "Eid-ul-Adha",
+}
+for _day in (21, 23, 25, 27, 29):
+    HOLIDAYS[9, _day] = "Lailat-ul-Qadr"
+HAJJ_DAYS = range(8, 14)
+
+
+def _umm_al_qura_year_lengths(index):
+    mask = UMM_AL_QURA_MONTHS[index]
+    year = UMM_AL_QURA_FIRST_YEAR + index
+    return [UMM_AL_QURA_IRREGULAR.get((year, month), 30 if mask >> (month - 1) & 1 else 29) for month in range(1, 13)]
+
+
+def _build_month_starts():
+    """Ordinal of the first day of every Umm al-Qura month, plus the day
+    after the last, indexed by months since 1 Muharram 1343."""
+    starts = [UMM_AL_QURA_EPOCH]
+    for index in range(len(UMM_AL_QURA_MONTHS)):
+        for length in _umm_al_qura_year_lengths(index):
+            starts.append(starts[-1] + length)
+    return starts
+
+
+_MONTH_STARTS = _build_month_starts()
+
+
+def _tabular_to_ordinal(year, month, day):
+    return TABULAR_EPOCH + day + math.ceil(29.5 * (month - 1)) + (year - 1) * 354 + (3 + 11 * year) // 30
+
+
+def _tabular_from_ordinal(ordinal):
+    # The estimate can be a year out either way around 1 Muharram
+    year = (30 * (ordinal - TABULAR_EPOCH) + 10646) // 10631
+    if ordinal < _tabular_to_ordinal(year, 1, 1):
+        year -= 1
+    elif ordinal >= _tabular_to_ordinal(year + 1, 1, 1):
+        year += 1
+    month = min(12, math.ceil((ordinal - 29 - _tabular_to_ordinal(year, 1, 1)) / 29.5) + 1)
+    return year, month, ordinal - _tabular_to_ordinal(year, month, 1) + 1
+
+
+# Days the tabular calendar is moved by on either side of the table, so it
+# continues from the table's first and last month without a gap or overlap
+_SHIFT_BEFORE = UMM_AL_QURA_EPOCH - _tabular_to_ordinal(UMM_AL_QURA_FIRST_YEAR, 1, 1)
+_SHIFT_AFTER = _MONTH_STARTS[-1] - _tabular_to_ordinal(UMM_AL_QURA_LAST_YEAR + 1, 1, 1)
+
+
+def _umm_al_qura_index(year, month):
+    return (year - UMM_AL_QURA_FIRST_YEAR) * 12 + month - 1
+
+
+def month_length(month, year):
+    if UMM_AL_QURA_FIRST_YEAR <= year <= UMM_AL_QURA_LAST_YEAR:
+        index = _umm_al_qura_index(year, month)
+        return _MONTH_STARTS[index + 1] - _MONTH_STARTS[index]
+    if month < 12:
+        return 30 if month % 2 else 29
+    return 30 if (14 + 11 * year) % 30 < 11 else 29
+
+
+def to_gregorian(year, month, day):
+    """Gregorian date of a Hijri date."""
+    if not 1 <= month <= 12 or not 1 <= day <= month_length(month, year):
+        raise ValueError(f"{day}-{month}-{year} AH is not a valid Hijri date")
+    if UMM_AL_QURA_FIRST_YEAR <= year <= UMM_AL_QURA_LAST_YEAR:
+        return datetime.date.fromordinal(_MONTH_STARTS[_umm_al_qura_index(year, month)] + day - 1)
+    shift = _SHIFT_BEFORE if year < UMM_AL_QURA_FIRST_YEAR else _SHIFT_AFTER
+    return datetime.date.fromordinal(_tabular_to_ordinal(year, month, day) + shift)
+
+
+def to_hijri(date):
+    """(year, month, day) of a Gregorian date."""
+    ordinal = date.toordinal()
+    if ordinal < _MONTH_STARTS[0]:
+        return _tabular_from_ordinal(ordinal - _SHIFT_BEFORE)
+    if ordinal >= _MONTH_STARTS[-1]:
+        return _tabular_from_ordinal(ordinal - _SHIFT_AFTER)
+    # Largest month start not after the date
+    low, high = 0, len(_MONTH_STARTS) - 2
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _MONTH_STARTS[middle] <= ordinal:
+            low = middle
+        else:
+            high = middle - 1
+    year, month = divmod(low, 12)
+    return UMM_AL_QURA_FIRST_YEAR + year, month + 1, ordinal - _MONTH_STARTS[low] + 1
+
+
+def _holidays(month, day, date):
+    names = []
+    if (month, day) in HOLIDAYS:
+        names.append(HOLIDAYS[month, day])
+    if month == 7 and day <= 7 and date.weekday() == 3:
+        # The night before the first Friday of Rajab
+        names.append("Lailat-ul-Ragha'ib")
+    if month == 12 and day in HAJJ_DAYS:
+        names.append("Hajj")
+    return names
+
+
+def month_days(month, year):
+    """Every day of a Hijri month as Aladhan's hToGCalendar entries."""
+    days = []
+    first = to_gregorian(year, month, 1)
+    length = month_length(month, year)
+    for day in range(1, length + 1):
+        date = first + datetime.timedelta(days=day - 1)
+        days.append({
+            'hijri': {
+                'date': f"{day:02d}-{month:02d}-{year}",
+                'format': 'DD-MM-YYYY',
+                'day': f"{day:02d}",
+                'month': {'number': month, 'en': MONTHS_EN[month - 1], 'days': length},
+                'year': str(year),
+                'holidays': _holidays(month, day, date),
+            },
+            'gregorian': {
+                'date': date.strftime('%d-%m-%Y'),
+                'format': 'DD-MM-YYYY',
+                'day': date.strftime('%d'),
+                'weekday': {'en': date.strftime('%A')},
+                'month': {'number': date.month, 'en': date.strftime('%B')},
+                'year': str(date.year),
+            },
+        })
+    return days
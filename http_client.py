@@ -0,0 +1,105 @@
+import asyncio
+import collections
+import contextlib
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+USER_AGENT = 'Adhan-Bot/1.0'
+
+# Per-upstream request timeout (seconds) and how many requests may be in
+# flight at once. Nominatim's usage policy allows a single client one
+# request at a time.
+UPSTREAMS = {
+    'aladhan': {'timeout': 10, 'concurrency': 20},
+    'nominatim': {'timeout': 10, 'concurrency': 1},
+    'overpass': {'timeout': 35, 'concurrency': 4},
+}
+
+POOL_LIMIT = 100
+POOL_LIMIT_PER_HOST = 20
+DNS_CACHE_SECONDS = 300
+KEEPALIVE_SECONDS = 60
+
+# How many recent requests the latency percentiles are taken over
+SAMPLE_SIZE = 500
+
+
+class HttpClient:
+    """The one aiohttp session every cog shares (bot.http_client).
+
+    Connections are pooled and kept alive per host, DNS answers are cached,
+    and responses are gzip-negotiated. Each upstream gets its own timeout and
+    concurrency cap, and per-host usage and latency are recorded for stats().
+    """
+
+    def __init__(self):
+        self.session = None
+        self._limits = {name: asyncio.Semaphore(config['concurrency']) for name, config in UPSTREAMS.items()}
+        self._hosts = collections.defaultdict(lambda: {
+            'in_flight': 0,
+            'requests': 0,
+            'errors': 0,
+            'latency': collections.deque(maxlen=SAMPLE_SIZE),
+        })
+
+    async def connect(self):
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_SECONDS,
+            keepalive_timeout=KEEPALIVE_SECONDS,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'},
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @contextlib.asynccontextmanager
+    async def request(self, upstream, method, url, **kwargs):
+        """Like session.request(), under the upstream's timeout and limit."""
+        kwargs.setdefault('timeout', aiohttp.ClientTimeout(total=UPSTREAMS[upstream]['timeout']))
+        host = self._hosts[urlsplit(url).hostname]
+        async with self._limits[upstream]:
+            host['in_flight'] += 1
+            host['requests'] += 1
+            started = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    yield response
+            except Exception:
+                host['errors'] += 1
+                raise
+            finally:
+                host['in_flight'] -= 1
+                host['latency'].append(time.monotonic() - started)
+
+    def get(self, upstream, url, **kwargs):
+        return self.request(upstream, 'GET', url, **kwargs)
+
+    def post(self, upstream, url, **kwargs):
+        return self.request(upstream, 'POST', url, **kwargs)
+
+    def stats(self):
+        """Per-host pool usage and latency (ms)."""
+        hosts = {}
+        for name, host in self._hosts.items():
+            ordered = sorted(host['latency'])
+            hosts[name] = {
+                'in_flight': host['in_flight'],
+                'requests': host['requests'],
+                'errors': host['errors'],
+                'latency_p50_ms': round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+                'latency_p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1) if ordered else None,
+            }
+        return {
+            'pool_limit': POOL_LIMIT,
+            'pool_limit_per_host': POOL_LIMIT_PER_HOST,
+            'hosts': hosts,
+        }
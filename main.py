@@ -5,21 +5,39 @@ import asyncio
 from dotenv import load_dotenv
 
 from database import Database
+from http_client import HttpClient
+from stats import MemberCounts
+from timings_cache import TimingsCache
 
 load_dotenv()
 TOKEN = os.getenv("TOKEN")
+# 'aladhan' (default) or 'local' to compute prayer times offline
+TIMINGS_SOURCE = os.getenv("TIMINGS_SOURCE", "aladhan")
+# "1" batches database writes from concurrent users into shared commits
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT") == "1"
+# Read-only SQLite connections next to the writer; 0 reads through the writer
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# UTC hour for the daily full database maintenance pass
+DB_MAINTENANCE_HOUR = int(os.getenv("DB_MAINTENANCE_HOUR", "4"))
 
 intents = discord.Intents.all()
 intents.message_content = True
 bot = commands.Bot(command_prefix='A!', intents=intents)
 
-bot.db = Database()
+bot.db = Database(group_commit=DB_GROUP_COMMIT, readers=DB_READERS, maintenance_hour=DB_MAINTENANCE_HOUR)
+bot.http_client = HttpClient()
+bot.timings = TimingsCache(bot.http_client, source=TIMINGS_SOURCE, store=bot.db)
+# Reminders fire at the same times /timings shows (with the local source the
+# offline schedule already is that)
+if TIMINGS_SOURCE != 'local':
+    bot.db.schedule_source = bot.timings.schedule_rows
+bot.members = MemberCounts()
 
 PRESENCE_INTERVAL_SECONDS = 120
 
 async def build_presences():
-    stats = await bot.db.get_stats()
-    member_count = sum(guild.member_count or 0 for guild in bot.guilds)
+    stats = bot.db.get_stats()
+    member_count = bot.members.total
     presences = [
         discord.CustomActivity(name="Reminding the Ummah to pray"),
         discord.CustomActivity(name=f"Serving {stats['users']} believers in {len(bot.guilds)} servers"),
@@ -49,6 +67,7 @@ async def before_rotate_presence():
 
 @bot.event
 async def on_ready():
+    bot.members.reset(bot.guilds)
     if not rotate_presence.is_running():
         rotate_presence.start()
     if not getattr(bot, 'synced', False):
@@ -56,6 +75,22 @@ async def on_ready():
         bot.synced = True
     print(f'We have logged in as {bot.user.name}')
 
+@bot.listen()
+async def on_guild_join(guild):
+    bot.members.guild_joined(guild)
+
+@bot.listen()
+async def on_guild_remove(guild):
+    bot.members.guild_left(guild)
+
+@bot.listen()
+async def on_member_join(member):
+    bot.members.member_joined(member.guild)
+
+@bot.listen()
+async def on_member_remove(member):
+    bot.members.member_left(member.guild)
+
 async def load():
     for filename in os.listdir("./cogs"):
         if filename.endswith(".py"):
@@ -64,11 +99,14 @@ async def load():
 
 async def main():
     await bot.db.connect()
+    bot.db.start_maintenance()
+    await bot.http_client.connect()
     try:
         async with bot:
             await load()
             await bot.start(TOKEN)
     finally:
+        await bot.http_client.close()
         await bot.db.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,350 @@
+import datetime
+import math
+
+import numpy as np
+import pytz
+
+import hijri
+
+# Twilight angles behind each Aladhan method id (the keys of
+# cogs.setup.calculation_methods). A value ending in 'min' is minutes after
+# maghrib instead of an angle; Tehran is the only method whose maghrib is an
+# angle rather than sunset. Umm Al-Qura's isha moves to 120 minutes during
+# Ramadan, as Aladhan's does.
+METHOD_PARAMS = {
+    '1': {'fajr': 18, 'isha': 18},                  # Karachi
+    '2': {'fajr': 15, 'isha': 15},                  # ISNA
+    '3': {'fajr': 18, 'isha': 17},                  # MWL
+    '4': {'fajr': 18.5, 'isha': '90 min', 'ramadan_isha': '120 min'},  # Umm Al-Qura
+    '5': {'fajr': 19.5, 'isha': 17.5},              # Egypt
+    '7': {'fajr': 17.7, 'isha': 14, 'maghrib': 4.5},  # Tehran
+    '8': {'fajr': 19.5, 'isha': '90 min'},          # Gulf
+    '9': {'fajr': 18, 'isha': 17.5},                # Kuwait
+    '10': {'fajr': 18, 'isha': '90 min'},           # Qatar
+    '11': {'fajr': 20, 'isha': 18},                 # Singapore
+    '12': {'fajr': 12, 'isha': 12},                 # France
+    '13': {'fajr': 18, 'isha': 17},                 # Turkey
+    '14': {'fajr': 16, 'isha': 15},                 # Russia
+}
+
+# Aladhan's asr_method/school: '0' standard (shadow = 1x), '1' Hanafi (2x)
+ASR_FACTORS = {'0': 1, '1': 2}
+
+# Sun's upper limb touching the horizon, with refraction
+SUNRISE_ANGLE = 0.833
+
+TIMING_NAMES = ['Fajr', 'Sunrise', 'Dhuhr', 'Asr', 'Sunset', 'Maghrib', 'Isha']
+
+
+def _fix(value, modulus):
+    value -= modulus * math.floor(value / modulus)
+    return value
+
+
+def _sin(d):
+    return math.sin(math.radians(d))
+
+
+def _cos(d):
+    return math.cos(math.radians(d))
+
+
+def _tan(d):
+    return math.tan(math.radians(d))
+
+
+def _arcsin(x):
+    return math.degrees(math.asin(x))
+
+
+def _arccos(x):
+    return math.degrees(math.acos(x))
+
+
+def _arccot(x):
+    return math.degrees(math.atan(1 / x))
+
+
+def julian_day(date: datetime.date) -> float:
+    """Julian day at 0h UT of a Gregorian date."""
+    year, month = date.year, date.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year // 100
+    b = 2 - a + a // 4
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + date.day + b - 1524.5
+
+
+def sun_position(jd: float):
+    """Solar declination and equation of time (hours) for a Julian day.
+
+    Low-precision formulae from the US Naval Observatory, good to about a
+    minute of time for 1950-2050.
+    """
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360)
+    q = _fix(280.459 + 0.98564736 * d, 360)
+    ecliptic_lon = _fix(q + 1.915 * _sin(g) + 0.020 * _sin(2 * g), 360)
+    obliquity = 23.439 - 0.00000036 * d
+
+    right_ascension = _fix(math.degrees(math.atan2(_cos(obliquity) * _sin(ecliptic_lon), _cos(ecliptic_lon))) / 15, 24)
+    declination = _arcsin(_sin(obliquity) * _sin(ecliptic_lon))
+    equation_of_time = q / 15 - right_ascension
+    return declination, equation_of_time
+
+
+class _Day:
+    """Solar geometry for one date and latitude, in local solar hours."""
+
+    def __init__(self, jd, latitude):
+        self.jd = jd
+        self.latitude = latitude
+
+    def mid_day(self, t):
+        _, eqt = sun_position(self.jd + t)
+        return _fix(12 - eqt, 24)
+
+    def sun_angle_time(self, angle, t, before_noon=False):
+        declination, _ = sun_position(self.jd + t)
+        noon = self.mid_day(t)
+        cos_hour = (-_sin(angle) - _sin(declination) * _sin(self.latitude)) / (_cos(declination) * _cos(self.latitude))
+        if not -1 <= cos_hour <= 1:
+            return math.nan
+        hours = _arccos(cos_hour) / 15
+        return noon - hours if before_noon else noon + hours
+
+    def asr_time(self, factor, t):
+        declination, _ = sun_position(self.jd + t)
+        angle = -_arccot(factor + _tan(abs(self.latitude - declination)))
+        return self.sun_angle_time(angle, t)
+
+
+def _is_minutes(value):
+    return isinstance(value, str) and value.endswith('min')
+
+
+def _minutes(value):
+    return float(value.split()[0])
+
+
+def _isha_rule(params, date):
+    if 'ramadan_isha' in params and hijri.to_hijri(date)[1] == 9:
+        return params['ramadan_isha']
+    return params['isha']
+
+
+def compute_hours(date: datetime.date, latitude: float, longitude: float, utc_offset: float,
+                  method: str = '2', asr_method: str = '1'):
+    """Prayer times for a date as fractional local hours (may be NaN).
+
+    Follows the PrayTimes algorithm Aladhan is built on, including its
+    default angle-based high-latitude adjustment.
+    """
+    params = METHOD_PARAMS[method]
+    isha_rule = _isha_rule(params, date)
+    day = _Day(julian_day(date) - longitude / (15 * 24), latitude)
+
+    # One refinement pass starting from typical times, as a fraction of a day
+    fajr = day.sun_angle_time(params['fajr'], 5 / 24, before_noon=True)
+    sunrise = day.sun_angle_time(SUNRISE_ANGLE, 6 / 24, before_noon=True)
+    dhuhr = day.mid_day(12 / 24)
+    asr = day.asr_time(ASR_FACTORS[asr_method], 13 / 24)
+    sunset = day.sun_angle_time(SUNRISE_ANGLE, 18 / 24)
+    maghrib = day.sun_angle_time(params['maghrib'], 18 / 24) if 'maghrib' in params else sunset
+    isha = math.nan if _is_minutes(isha_rule) else day.sun_angle_time(isha_rule, 18 / 24)
+
+    shift = utc_offset - longitude / 15
+    fajr, sunrise, dhuhr, asr, sunset, maghrib, isha = (
+        value + shift for value in (fajr, sunrise, dhuhr, asr, sunset, maghrib, isha)
+    )
+
+    # Angle-based high-latitude rule: clamp twilight to angle/60 of the night.
+    # Under the midnight sun or polar night there is no night to portion.
+    if math.isnan(sunrise) or math.isnan(sunset):
+        if _is_minutes(isha_rule):
+            isha = maghrib + _minutes(isha_rule) / 60
+        return fajr, sunrise, dhuhr, asr, sunset, maghrib, isha
+    night = _fix(sunrise - sunset, 24)
+    fajr_portion = params['fajr'] / 60 * night
+    if math.isnan(fajr) or _fix(sunrise - fajr, 24) > fajr_portion:
+        fajr = sunrise - fajr_portion
+    if not _is_minutes(isha_rule):
+        isha_portion = isha_rule / 60 * night
+        if math.isnan(isha) or _fix(isha - sunset, 24) > isha_portion:
+            isha = sunset + isha_portion
+    if 'maghrib' in params:
+        maghrib_portion = params['maghrib'] / 60 * night
+        if math.isnan(maghrib) or _fix(maghrib - sunset, 24) > maghrib_portion:
+            maghrib = sunset + maghrib_portion
+    if _is_minutes(isha_rule):
+        isha = maghrib + _minutes(isha_rule) / 60
+
+    return fajr, sunrise, dhuhr, asr, sunset, maghrib, isha
+
+
+def format_hours(value: float) -> str:
+    """Fractional hours to Aladhan's 'HH:MM', rounded to the nearest minute."""
+    minutes = int(_fix(value + 0.5 / 60, 24) * 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def utc_offset_hours(timezone: str, date: datetime.date) -> float:
+    """The timezone's UTC offset at local noon on the date, DST included."""
+    tz = pytz.timezone(timezone)
+    noon = tz.localize(datetime.datetime.combine(date, datetime.time(12)))
+    return noon.utcoffset().total_seconds() / 3600
+
+
+def compute_timings(date: datetime.date, latitude: float, longitude: float, timezone: str,
+                    method: str = '2', asr_method: str = '1'):
+    """Timings dict in the shape of Aladhan's /v1/timings 'timings' field.
+
+    Times that don't occur (the sun never setting, say) are left out.
+    """
+    hours = compute_hours(date, latitude, longitude, utc_offset_hours(timezone, date), method, asr_method)
+    return {name: format_hours(value) for name, value in zip(TIMING_NAMES, hours) if not math.isnan(value)}
+
+
+def compute_month(year: int, month: int, latitude: float, longitude: float, timezone: str,
+                  method: str = '2', asr_method: str = '1'):
+    """Entries shaped like Aladhan's /v1/calendar response for one month."""
+    entries = []
+    date = datetime.date(year, month, 1)
+    while date.month == month:
+        entries.append({
+            'timings': compute_timings(date, latitude, longitude, timezone, method, asr_method),
+            'date': {'gregorian': {'date': date.strftime('%d-%m-%Y'), 'day': date.strftime('%d')}},
+        })
+        date += datetime.timedelta(days=1)
+    return entries
+
+
+# Order of the columns compute_batch returns
+BATCH_PRAYERS = ['Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']
+
+
+def _sun_position_array(jd):
+    d = jd - 2451545.0
+    g = np.mod(357.529 + 0.98560028 * d, 360)
+    q = np.mod(280.459 + 0.98564736 * d, 360)
+    ecliptic_lon = np.mod(q + 1.915 * np.sin(np.radians(g)) + 0.020 * np.sin(np.radians(2 * g)), 360)
+    obliquity = np.radians(23.439 - 0.00000036 * d)
+    ecliptic_rad = np.radians(ecliptic_lon)
+
+    right_ascension = np.mod(np.degrees(np.arctan2(np.cos(obliquity) * np.sin(ecliptic_rad), np.cos(ecliptic_rad))) / 15, 24)
+    declination = np.degrees(np.arcsin(np.sin(obliquity) * np.sin(ecliptic_rad)))
+    return declination, q / 15 - right_ascension
+
+
+def _solar_array(jd):
+    """Declination and local solar noon (hours) for an array of Julian days."""
+    declination, eqt = _sun_position_array(jd)
+    return declination, np.mod(12 - eqt, 24)
+
+
+def _hour_angle_array(declination, latitude, angle):
+    """Hours from noon until the sun sits `angle` degrees below the horizon."""
+    lat, decl = np.radians(latitude), np.radians(declination)
+    cos_hour = (-np.sin(np.radians(angle)) - np.sin(decl) * np.sin(lat)) / (np.cos(decl) * np.cos(lat))
+    return np.degrees(np.arccos(cos_hour)) / 15
+
+
+def method_arrays(methods, date: datetime.date):
+    """Per-method parameters on a date as arrays; NaN where a rule doesn't
+    apply."""
+    fajr, isha, isha_minutes, maghrib = [], [], [], []
+    isha_rules = {method: _isha_rule(METHOD_PARAMS[method], date) for method in set(methods)}
+    for method in methods:
+        params = METHOD_PARAMS[method]
+        isha_rule = isha_rules[method]
+        fajr.append(params['fajr'])
+        if _is_minutes(isha_rule):
+            isha.append(math.nan)
+            isha_minutes.append(_minutes(isha_rule))
+        else:
+            isha.append(isha_rule)
+            isha_minutes.append(math.nan)
+        maghrib.append(params.get('maghrib', math.nan))
+    return {
+        'fajr_angles': np.array(fajr, dtype=float),
+        'isha_angles': np.array(isha, dtype=float),
+        'isha_minutes': np.array(isha_minutes, dtype=float),
+        'maghrib_angles': np.array(maghrib, dtype=float),
+    }
+
+
+def batch_inputs(users, date: datetime.date):
+    """compute_batch keyword arguments for a list of settings records, such
+    as Database.iter_user_pages() yields."""
+    offsets = {}
+    utc_offsets = []
+    for user in users:
+        if user["timezone"] not in offsets:
+            offsets[user["timezone"]] = utc_offset_hours(user["timezone"], date)
+        utc_offsets.append(offsets[user["timezone"]])
+    return {
+        'latitudes': np.array([user["latitude"] for user in users], dtype=float),
+        'longitudes': np.array([user["longitude"] for user in users], dtype=float),
+        'asr_factors': np.array([ASR_FACTORS[user["asr_method"]] for user in users], dtype=float),
+        'utc_offsets': np.array(utc_offsets, dtype=float),
+        **method_arrays([user["calculation_method"] for user in users], date),
+    }
+
+
+def compute_batch(date: datetime.date, latitudes, longitudes, fajr_angles, isha_angles,
+                  isha_minutes, maghrib_angles, asr_factors, utc_offsets):
+    """The five prayers of one local date for many users in a single pass.
+
+    Returns an (n, 5) array of UTC epoch seconds in BATCH_PRAYERS order,
+    rounded to the minute shown to users and NaN where a prayer doesn't
+    occur. Same algorithm as compute_hours, one array operation per step.
+    """
+    # Users geocoded to the same place share every input; compute each
+    # distinct row once and fan the results back out. Rows are compared as
+    # raw bytes so the NaN placeholders count as equal.
+    inputs = np.ascontiguousarray(np.column_stack([
+        latitudes, longitudes, fajr_angles, isha_angles, isha_minutes, maghrib_angles, asr_factors, utc_offsets,
+    ]), dtype=float)
+    rows = inputs.view(np.dtype((np.void, inputs.dtype.itemsize * inputs.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    latitudes, longitudes, fajr_angles, isha_angles, isha_minutes, maghrib_angles, asr_factors, utc_offsets = inputs[first].T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jd = julian_day(date) - longitudes / (15 * 24)
+
+        # The scalar path evaluates the sun at five distinct times of day
+        decl_fajr, noon_fajr = _solar_array(jd + 5 / 24)
+        decl_sunrise, noon_sunrise = _solar_array(jd + 6 / 24)
+        _, dhuhr = _solar_array(jd + 12 / 24)
+        decl_asr, noon_asr = _solar_array(jd + 13 / 24)
+        decl_evening, noon_evening = _solar_array(jd + 18 / 24)
+
+        fajr = noon_fajr - _hour_angle_array(decl_fajr, latitudes, fajr_angles)
+        sunrise = noon_sunrise - _hour_angle_array(decl_sunrise, latitudes, SUNRISE_ANGLE)
+        asr_angles = -np.degrees(np.arctan(1 / (asr_factors + np.tan(np.radians(np.abs(latitudes - decl_asr))))))
+        asr = noon_asr + _hour_angle_array(decl_asr, latitudes, asr_angles)
+        sunset = noon_evening + _hour_angle_array(decl_evening, latitudes, SUNRISE_ANGLE)
+        maghrib = np.where(np.isnan(maghrib_angles), sunset,
+                           noon_evening + _hour_angle_array(decl_evening, latitudes, maghrib_angles))
+        isha = noon_evening + _hour_angle_array(decl_evening, latitudes, isha_angles)
+
+        night = np.mod(sunrise - sunset, 24)
+        has_night = ~np.isnan(night)
+        fajr_portion = fajr_angles / 60 * night
+        fajr = np.where(has_night & (np.isnan(fajr) | (np.mod(sunrise - fajr, 24) > fajr_portion)),
+                        sunrise - fajr_portion, fajr)
+        isha_portion = isha_angles / 60 * night
+        isha = np.where(has_night & (np.isnan(isha) | (np.mod(isha - sunset, 24) > isha_portion)),
+                        sunset + isha_portion, isha)
+        maghrib_portion = maghrib_angles / 60 * night
+        maghrib = np.where(has_night & ~np.isnan(maghrib_angles) & (np.isnan(maghrib) | (np.mod(maghrib - sunset, 24) > maghrib_portion)),
+                           sunset + maghrib_portion, maghrib)
+        isha = np.where(np.isnan(isha_minutes), isha, maghrib + isha_minutes / 60)
+
+        local_hours = np.stack([fajr, dhuhr, asr, maghrib, isha], axis=1) + (utc_offsets - longitudes / 15)[:, None]
+        local_minutes = np.floor(local_hours * 60 + 0.5)
+
+    midnight_utc = datetime.datetime.combine(date, datetime.time.min, tzinfo=datetime.timezone.utc).timestamp()
+    fire_times = midnight_utc + local_minutes * 60 - utc_offsets[:, None] * 3600
+    return fire_times[inverse.reshape(-1)]
@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class NotificationScheduler:
+    """One timer for every subscription instead of one sleeping task each.
+
+    Entries live in a min-heap keyed by their UTC fire time (epoch seconds).
+    A single runner task sleeps until the earliest entry is due, then pops
+    everything falling in that same second and hands the whole batch to
+    `dispatch` at once. Rescheduling or cancelling a key just marks its old
+    heap node stale; stale nodes are skipped when they surface.
+    """
+
+    def __init__(self, dispatch):
+        self._dispatch = dispatch
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task = None
+        self._in_flight = set()
+        self.wakeups = 0
+        self.dispatched = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._in_flight):
+            task.cancel()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, key, fire_at, payload=None):
+        """(Re)schedule key to fire at the given UTC epoch time."""
+        entry = [fire_at, next(self._counter), key, payload]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._changed.set()
+
+    def cancel(self, key):
+        """Drop key's pending entry. Returns False if nothing was scheduled."""
+        return self._entries.pop(key, None) is not None
+
+    def stats(self):
+        """Counters for capacity planning."""
+        return {
+            'pending': len(self._entries),
+            'heap_size': len(self._heap),
+            'wakeups': self.wakeups,
+            'dispatched': self.dispatched,
+        }
+
+    def _is_live(self, entry):
+        return self._entries.get(entry[2]) is entry
+
+    def _pop_due(self, now):
+        """Pop every live entry due by now that shares the earliest entry's second."""
+        batch = []
+        second = None
+        while self._heap and self._heap[0][0] <= now:
+            entry = self._heap[0]
+            if not self._is_live(entry):
+                heapq.heappop(self._heap)
+                continue
+            if second is None:
+                second = int(entry[0])
+            elif int(entry[0]) != second:
+                break
+            heapq.heappop(self._heap)
+            del self._entries[entry[2]]
+            batch.append((entry[2], entry[3]))
+        return batch
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._is_live(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._changed.clear()
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - time.time()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.wakeups += 1
+            batch = self._pop_due(time.time())
+            if not batch:
+                continue
+            self.dispatched += len(batch)
+            # Sends can take a while; don't let a slow batch delay the next one
+            task = asyncio.get_running_loop().create_task(self._dispatch_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch_batch(self, batch):
+        try:
+            await self._dispatch(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error dispatching {len(batch)} scheduled notifications: {e}")
@@ -0,0 +1,154 @@
+import bisect
+from collections import Counter
+
+
+def _key(name):
+    return name.strip().lower()
+
+
+class SettingsStats:
+    """Presence numbers kept current as settings are written, so reading
+    them never scans user_settings.
+
+    Every user's contribution (country, location cell, city, loop flag) is
+    remembered, so set() replaces it and concurrent writes to one user can't
+    double-count. Cities are clustered by location cell (~11 km grid) rather
+    than by the stored text, so spelling variants of one place count once.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._countries = Counter()
+        self._cells = Counter()
+        # cell -> Counter of normalized city names, and the name to show
+        self._cell_cities = {}
+        self._city_names = {}
+        self.active_loops = 0
+        self._top_cell = None
+        self._top_stale = False
+
+    def set(self, user_id, country, city, cell, active):
+        """Record a user's current settings; cell is None without coordinates."""
+        if user_id in self._users:
+            self.discard(user_id)
+        country_key, city_key, active = _key(country), _key(city), bool(active)
+        self._users[user_id] = (country_key, cell, city_key, active)
+        self._countries[country_key] += 1
+        self.active_loops += active
+        if cell is None:
+            return
+        self._cells[cell] += 1
+        cities = self._cell_cities.get(cell)
+        if cities is None:
+            cities = self._cell_cities[cell] = Counter()
+        cities[city_key] += 1
+        self._city_names[cell, city_key] = city
+        if not self._top_stale and (self._top_cell is None or self._cells[cell] > self._cells[self._top_cell]):
+            self._top_cell = cell
+
+    def set_active(self, user_id, active):
+        entry = self._users.get(user_id)
+        if entry is not None and entry[3] != bool(active):
+            self._users[user_id] = (*entry[:3], bool(active))
+            self.active_loops += 1 if active else -1
+
+    def discard(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        country, cell, city, active = entry
+        self._countries[country] -= 1
+        if not self._countries[country]:
+            del self._countries[country]
+        self.active_loops -= active
+        if cell is None:
+            return
+        self._cells[cell] -= 1
+        cities = self._cell_cities[cell]
+        cities[city] -= 1
+        if not cities[city]:
+            del cities[city]
+            del self._city_names[cell, city]
+        if not self._cells[cell]:
+            del self._cells[cell]
+            del self._cell_cities[cell]
+        if cell == self._top_cell:
+            # Only a shrinking leader forces a rescan, and only on next read
+            self._top_stale = True
+
+    def snapshot(self):
+        if self._top_stale:
+            self._top_cell = max(self._cells, key=self._cells.__getitem__, default=None)
+            self._top_stale = False
+        top_city, top_city_users = None, 0
+        if self._top_cell is not None:
+            city = self._cell_cities[self._top_cell].most_common(1)[0][0]
+            top_city = self._city_names[self._top_cell, city]
+            top_city_users = self._cells[self._top_cell]
+        return {
+            'users': len(self._users),
+            'countries': len(self._countries),
+            'cities': len(self._cells),
+            'active_loops': self.active_loops,
+            'top_city': top_city,
+            'top_city_users': top_city_users,
+        }
+
+
+class MemberCounts:
+    """Total members across the bot's guilds, kept from join/leave events."""
+
+    def __init__(self):
+        self._guilds = {}
+        self.total = 0
+
+    def reset(self, guilds):
+        self._guilds = {guild.id: guild.member_count or 0 for guild in guilds}
+        self.total = sum(self._guilds.values())
+
+    def guild_joined(self, guild):
+        self.guild_left(guild)
+        self._guilds[guild.id] = guild.member_count or 0
+        self.total += self._guilds[guild.id]
+
+    def guild_left(self, guild):
+        self.total -= self._guilds.pop(guild.id, 0)
+
+    def member_joined(self, guild):
+        if guild.id in self._guilds:
+            self._guilds[guild.id] += 1
+            self.total += 1
+
+    def member_left(self, guild):
+        if self._guilds.get(guild.id):
+            self._guilds[guild.id] -= 1
+            self.total -= 1
+
+
+# Upper bounds (ms) of LatencyHistogram buckets; Discord drops an
+# interaction that isn't answered within 3 s
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2000, 3000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency counts per label (e.g. which path a command took)."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self._counts = {}
+
+    def record(self, seconds, label='all'):
+        counts = self._counts.get(label)
+        if counts is None:
+            counts = self._counts[label] = [0] * (len(self.bounds) + 1)
+        counts[bisect.bisect_left(self.bounds, seconds * 1000)] += 1
+
+    def snapshot(self):
+        return {
+            label: {
+                **{f"<={bound}ms": count for bound, count in zip(self.bounds, counts)},
+                f">{self.bounds[-1]}ms": counts[-1],
+                'count': sum(counts),
+            }
+            for label, counts in self._counts.items()
+        }
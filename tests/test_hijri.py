@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+import hijri
+
+# Umm al-Qura dates as observed in Saudi Arabia
+KNOWN_DATES = [
+    ((1343, 1, 1), datetime.date(1924, 8, 1)),
+    ((1400, 1, 1), datetime.date(1979, 11, 20)),
+    ((1420, 9, 24), datetime.date(2000, 1, 1)),
+    ((1444, 9, 1), datetime.date(2023, 3, 23)),
+    ((1445, 9, 1), datetime.date(2024, 3, 11)),
+    ((1445, 10, 1), datetime.date(2024, 4, 10)),
+    ((1445, 12, 10), datetime.date(2024, 6, 16)),
+    ((1446, 1, 1), datetime.date(2024, 7, 7)),
+    ((1447, 9, 1), datetime.date(2026, 2, 18)),
+    ((1448, 5, 6), datetime.date(2026, 10, 17)),
+    ((1500, 12, 30), datetime.date(2077, 11, 16)),
+]
+
+
+@pytest.mark.parametrize('hijri_date, gregorian', KNOWN_DATES)
+def test_known_dates(hijri_date, gregorian):
+    assert hijri.to_gregorian(*hijri_date) == gregorian
+    assert hijri.to_hijri(gregorian) == hijri_date
+
+
+def test_round_trip_whole_table_and_tabular_edges():
+    first = hijri.to_gregorian(hijri.UMM_AL_QURA_FIRST_YEAR, 1, 1).toordinal()
+    last = hijri.to_gregorian(hijri.UMM_AL_QURA_LAST_YEAR, 12, 1).toordinal()
+    previous = None
+    for ordinal in range(first - 3000, last + 3000):
+        date = datetime.date.fromordinal(ordinal)
+        year, month, day = hijri.to_hijri(date)
+        assert 1 <= month <= 12 and 1 <= day <= hijri.month_length(month, year)
+        assert hijri.to_gregorian(year, month, day) == date
+        # Consecutive days, including across the table's edges
+        if previous is not None:
+            if day == 1:
+                assert previous[2] == hijri.month_length(previous[1], previous[0])
+                assert (year, month) == (previous[0] + (previous[1] == 12), previous[1] % 12 + 1)
+            else:
+                assert (year, month, day) == (previous[0], previous[1], previous[2] + 1)
+        previous = (year, month, day)
+
+
+def test_month_lengths():
+    for year in range(hijri.UMM_AL_QURA_FIRST_YEAR, hijri.UMM_AL_QURA_LAST_YEAR + 1):
+        lengths = [hijri.month_length(month, year) for month in range(1, 13)]
+        for month, length in enumerate(lengths, 1):
+            if (year, month) in hijri.UMM_AL_QURA_IRREGULAR:
+                assert length in (28, 31)
+            else:
+                assert length in (29, 30)
+        assert 353 <= sum(lengths) <= 356
+
+
+def test_invalid_date():
+    with pytest.raises(ValueError):
+        hijri.to_gregorian(1445, 13, 1)
+    with pytest.raises(ValueError):
+        hijri.to_gregorian(1445, 9, 31)
+
+
+def test_month_days_shape():
+    days = hijri.month_days(9, 1445)
+    assert len(days) == 30
+    first = days[0]
+    assert first['hijri']['date'] == '01-09-1445'
+    assert first['hijri']['month'] == {'number': 9, 'en': 'Ramaḍān', 'days': 30}
+    assert first['hijri']['holidays'] == ['1st Day of Ramadan']
+    assert first['gregorian']['date'] == '11-03-2024'
+    assert first['gregorian']['weekday'] == {'en': 'Monday'}
+    assert [day['gregorian']['date'] for day in days[:2]] == ['11-03-2024', '12-03-2024']
+
+
+def test_holidays():
+    eid = hijri.month_days(12, 1445)[9]
+    assert eid['gregorian']['date'] == '16-06-2024'
+    assert eid['hijri']['holidays'] == ['Eid-ul-Adha', 'Hajj']
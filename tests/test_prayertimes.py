@@ -0,0 +1,34 @@
+import datetime
+
+import pytest
+
+from prayertimes import BATCH_PRAYERS, batch_inputs, compute_batch, compute_timings
+
+MAKKAH = {'latitude': 21.42, 'longitude': 39.83, 'timezone': 'Asia/Riyadh', 'asr_method': '0'}
+
+
+def minutes_of(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+@pytest.mark.parametrize('date, gap', [
+    (datetime.date(2026, 2, 17), 90),   # 29 Sha'ban 1447
+    (datetime.date(2026, 2, 18), 120),  # 1 Ramadan
+    (datetime.date(2026, 3, 19), 120),  # 30 Ramadan
+    (datetime.date(2026, 3, 20), 90),   # 1 Shawwal
+])
+def test_umm_al_qura_isha_in_ramadan(date, gap):
+    timings = compute_timings(date, MAKKAH['latitude'], MAKKAH['longitude'], MAKKAH['timezone'], '4', '0')
+    assert minutes_of(timings['Isha']) - minutes_of(timings['Maghrib']) == gap
+
+
+@pytest.mark.parametrize('date', [datetime.date(2026, 2, 18), datetime.date(2026, 6, 1)])
+@pytest.mark.parametrize('method', ['2', '4', '7', '8'])
+def test_batch_matches_scalar(date, method):
+    user = {**MAKKAH, 'calculation_method': method}
+    fire_times = compute_batch(date, **batch_inputs([user], date))[0]
+    riyadh = datetime.timezone(datetime.timedelta(hours=3))
+    timings = compute_timings(date, user['latitude'], user['longitude'], user['timezone'], method, '0')
+    for prayer, fire_at in zip(BATCH_PRAYERS, fire_times):
+        assert datetime.datetime.fromtimestamp(fire_at, riyadh).strftime('%H:%M') == timings[prayer]
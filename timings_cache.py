@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+from collections import OrderedDict
+
+import pytz
+
+import database
+from database import geo_cell
+from prayertimes import BATCH_PRAYERS, compute_month
+
+ALADHAN_CALENDAR_URL = 'https://api.aladhan.com/v1/calendar'
+
+MAX_ENTRIES = 4096
+
+# 'aladhan' asks api.aladhan.com, 'local' computes with prayertimes.py
+SOURCES = ('aladhan', 'local')
+
+
+def cell_key(settings):
+    """Everything that makes two users' timings identical."""
+    return (
+        *geo_cell(settings["latitude"], settings["longitude"]),
+        settings["calculation_method"],
+        settings["asr_method"],
+        settings["timezone"],
+    )
+
+
+def cell_params(key):
+    """Aladhan query params for a cell, queried at the cell's centre so
+    every user in it gets byte-identical timings."""
+    latitude, longitude, method, school, timezone = key
+    return {
+        'latitude': str(latitude),
+        'longitude': str(longitude),
+        'method': method,
+        'school': school,
+        'timezonestring': timezone,
+    }
+
+
+def compact_entry(entry):
+    """Keep the parts of a calendar entry the cogs read; Aladhan's also
+    carry Hijri dates and metadata that would bloat the store tenfold."""
+    gregorian = entry['date']['gregorian']
+    return {
+        'timings': entry['timings'],
+        'date': {'gregorian': {'date': gregorian['date'], 'day': gregorian['day']}},
+    }
+
+
+class TimingsCache:
+    """Shared prayer timings, fetched a month at a time per location cell,
+    method, school and timezone, so upstream calls scale with distinct cells
+    and months rather than users or days.
+
+    Months are kept in memory (least recently used evicted beyond
+    max_entries) over the timings_months table of `store`, a Database, so
+    they survive restarts. Concurrent misses for one month share a single
+    upstream request. With source='local' misses are computed offline
+    instead, so an Aladhan outage can't stop reminders.
+    """
+
+    def __init__(self, http, source='aladhan', store=None, max_entries=MAX_ENTRIES):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown timings source {source!r}, expected one of: {', '.join(SOURCES)}")
+        self.source = source
+        self.max_entries = max_entries
+        self.http = http
+        self.store = store
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.upstream_calls = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'store_hits': self.store_hits,
+            'upstream_calls': self.upstream_calls,
+        }
+
+    async def day(self, settings, date: datetime.date):
+        """Timings dict ('Fajr': 'HH:MM', ...) for the user's local date,
+        taken from the month it falls in."""
+        for entry in await self.month(settings, date.year, date.month):
+            if int(entry['date']['gregorian']['day']) == date.day:
+                return entry['timings']
+        raise Exception("prayer time service returned an incomplete month")
+
+    def cached_day(self, settings, date: datetime.date):
+        """Like day(), but only from months already in memory: None instead
+        of any I/O, so callers can answer before deciding to wait."""
+        entries = self._entries.get((cell_key(settings), date.year, date.month))
+        if entries is None:
+            return None
+        for entry in entries:
+            if int(entry['date']['gregorian']['day']) == date.day:
+                return entry['timings']
+        return None
+
+    async def today(self, settings):
+        return await self.day(settings, datetime.datetime.now(pytz.timezone(settings["timezone"])).date())
+
+    async def month(self, settings, year: int, month: int):
+        """Calendar-endpoint entries for every day of the month."""
+        key = (cell_key(settings), year, month)
+        entries = self._entries.get(key)
+        if entries is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entries
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load_month(*key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._remember(key, t))
+        # A cancelled waiter must not cancel the fetch the others are sharing
+        return await asyncio.shield(task)
+
+    def _remember(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = task.result()
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def schedule_rows(self, users, start, end):
+        """(user_id, prayer, fire_at_utc) rows for every prayer of the given
+        settings records in [start, end), from this source's months: the
+        same times /timings shows. Database.schedule_source.
+
+        Cells whose months can't be loaded fall back to the offline engine,
+        so an Aladhan outage delays accuracy rather than reminders.
+        """
+        if self.source == 'local':
+            return await asyncio.to_thread(database.schedule_rows, users, start, end)
+        cells = {}
+        for user in users:
+            if user['latitude'] is not None and database.schedulable(user):
+                cells.setdefault(cell_key(user), []).append(user)
+        keys = list(cells)
+        results = await asyncio.gather(
+            *(self._cell_fire_times(cells[key][0], start, end) for key in keys), return_exceptions=True,
+        )
+        rows = []
+        offline = []
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                offline.extend(cells[key])
+                continue
+            for user in cells[key]:
+                rows.extend((int(user['user_id']), prayer, fire_at) for prayer, fire_at in result)
+        if offline:
+            failed = [result for result in results if isinstance(result, Exception)]
+            print(f"Timings unavailable for {len(failed)} cells ({failed[0]}); "
+                  f"scheduling their {len(offline)} users offline")
+            rows.extend(await asyncio.to_thread(database.schedule_rows, offline, start, end))
+        return rows
+
+    async def _cell_fire_times(self, settings, start, end):
+        """(prayer, fire_at_utc) for one cell's prayers in [start, end)."""
+        tz = pytz.timezone(settings['timezone'])
+        date = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).date() - datetime.timedelta(days=1)
+        last = datetime.datetime.fromtimestamp(end, datetime.timezone.utc).date() + datetime.timedelta(days=1)
+        fire_times = []
+        while date <= last:
+            timings = await self.day(settings, date)
+            for prayer in BATCH_PRAYERS:
+                if prayer not in timings:
+                    continue
+                # Aladhan appends the zone abbreviation: '05:12 (BST)'
+                hours, minutes = timings[prayer].split(' ')[0].split(':')
+                local = datetime.datetime.combine(date, datetime.time(int(hours), int(minutes)))
+                fire_at = int(tz.localize(local).timestamp())
+                if start <= fire_at < end:
+                    fire_times.append((prayer, fire_at))
+            date += datetime.timedelta(days=1)
+        return fire_times
+
+    async def _load_month(self, key, year, month):
+        if self.store is not None:
+            entries = await self.store.get_timings_month(key, self.source, year, month)
+            if entries is not None:
+                self.store_hits += 1
+                return entries
+        entries = [compact_entry(entry) for entry in await self._fetch_month(key, year, month)]
+        if self.store is not None:
+            try:
+                await self.store.put_timings_month(key, self.source, year, month, entries)
+            except Exception as e:
+                print(f"Error storing timings for {key} {year}-{month:02d}: {e}")
+        return entries
+
+    async def _request(self, url, params):
+        self.upstream_calls += 1
+        async with self.http.get('aladhan', url, params=params) as response:
+            data = await response.json()
+            if response.status != 200 or data.get('code') != 200:
+                raise Exception("prayer time service unavailable")
+            return data['data']
+
+    async def _fetch_month(self, key, year, month):
+        if self.source == 'local':
+            latitude, longitude, method, school, timezone = key
+            return compute_month(year, month, latitude, longitude, timezone, method, school)
+        return await self._request(f"{ALADHAN_CALENDAR_URL}/{year}/{month}", cell_params(key))